@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Author : Sz
+@Project: rtg-tools
+@File   : hbase_ddl.py
+@Time   : 2020/10/24 0024 15:07
+"""
+import random
+import zlib
+from typing import Dict, Iterable, List, Union
+
+from hbase.hbase_client.ttypes import (
+    TBloomFilterType,
+    TColumnFamilyDescriptor,
+    TCompressionAlgorithm,
+    TTableDescriptor,
+    TTableName,
+)
+from hbase.hbase_tools import HBaseClient
+
+
+def _to_bytes(key: Union[str, bytes]) -> bytes:
+    return key.encode() if isinstance(key, str) else bytes(key)
+
+
+def normalize_split_keys(keys: Iterable[Union[str, bytes]]) -> List[bytes]:
+    """
+    排序、去重并去掉空值，createTable 要求分割点有序且不能为空
+
+    :param keys:
+    :return:
+    """
+    return sorted({_to_bytes(key) for key in keys if key})
+
+
+def split_keys_from_sample(
+    keys: Iterable[Union[str, bytes]],
+    regions: int,
+    sample_size: int = 100000,
+    seed: int = None,
+) -> List[bytes]:
+    """
+    根据 row_key 的样本计算分割点，使每个 region 分到的样本数大致相同，
+    keys 可以是任意长度的迭代器（如逐行读取的待导入文件），只会保留 sample_size 个样本（蓄水池抽样）
+
+    :param keys: row_key 样本
+    :param regions: region 数量
+    :param sample_size: 最多保留的样本数
+    :param seed: 抽样的随机种子
+    :return:
+    """
+    rand = random.Random(seed)
+    sample = []
+    for seen, key in enumerate(keys):
+        if seen < sample_size:
+            sample.append(key)
+        else:
+            index = rand.randint(0, seen)
+            if index < sample_size:
+                sample[index] = key
+    sample = sorted(_to_bytes(key) for key in sample)
+    if regions <= 1 or not sample:
+        return []
+    return normalize_split_keys(
+        sample[len(sample) * i // regions] for i in range(1, regions)
+    )
+
+
+def salt_prefix(bucket: int, buckets: int) -> str:
+    """
+    第 bucket 个盐值桶的前缀，固定宽度的十进制数，保证按字节排序与数值顺序一致
+
+    :param bucket:
+    :param buckets: 桶的数量
+    :return:
+    """
+    return str(bucket).zfill(len(str(buckets - 1)))
+
+
+def salt_key(row_key: str, buckets: int) -> str:
+    """
+    给 row_key 加上盐值前缀，同一个 row_key 总是落在同一个桶中，
+    单调递增的 row_key（如时间戳）加盐后写入会分散到 buckets 个 region 上，
+    代价是范围扫描需要对每个桶各扫描一次
+
+    :param row_key:
+    :param buckets: 桶的数量
+    :return:
+    """
+    bucket = zlib.crc32(row_key.encode()) % buckets
+    return salt_prefix(bucket, buckets) + row_key
+
+
+def split_keys_from_salt(buckets: int) -> List[bytes]:
+    """
+    salt_key 对应的分割点，每个桶一个 region
+
+    :param buckets: 桶的数量
+    :return:
+    """
+    return [salt_prefix(bucket, buckets).encode() for bucket in range(1, buckets)]
+
+
+class HBaseAdmin(object):
+    """
+    基于 HBaseClient 的建表工具，
+    创建表时预先按分割点划分 region，批量导入从一开始就能写入多个 RegionServer，
+    而不是全部集中在一个 region 上等待自动分裂。
+    """
+
+    def __init__(self, client: HBaseClient):
+        self.client = client
+
+    @staticmethod
+    def table_name(table: str) -> TTableName:
+        """
+        表名转换为 TTableName，<namespace>:<table> 或省略 namespace
+        """
+        ns, _, qualifier = table.rpartition(":")
+        return TTableName(ns=ns.encode() if ns else None, qualifier=qualifier.encode())
+
+    @staticmethod
+    def family_descriptor(
+        name: str,
+        max_versions: int = None,
+        ttl: int = None,
+        compression: Union[int, str] = None,
+        bloom_filter: Union[int, str] = None,
+        in_memory: bool = None,
+        **kwargs,
+    ) -> TColumnFamilyDescriptor:
+        """
+        生成 column family 的描述
+
+        :param name:
+        :param max_versions: 保留的最大版本数
+        :param ttl: 数据的存活时间，秒
+        :param compression: TCompressionAlgorithm 的值或名称，如 "SNAPPY"
+        :param bloom_filter: TBloomFilterType 的值或名称，如 "ROW"
+        :param in_memory:
+        :param kwargs: 其他 TColumnFamilyDescriptor 的字段
+        :return:
+        """
+        if isinstance(compression, str):
+            compression = TCompressionAlgorithm._NAMES_TO_VALUES[compression.upper()]
+        if isinstance(bloom_filter, str):
+            bloom_filter = TBloomFilterType._NAMES_TO_VALUES[bloom_filter.upper()]
+        return TColumnFamilyDescriptor(
+            name=name.encode(),
+            maxVersions=max_versions,
+            timeToLive=ttl,
+            compressionType=compression,
+            bloomnFilterType=bloom_filter,
+            inMemory=in_memory,
+            **kwargs,
+        )
+
+    def table_exists(self, table: str) -> bool:
+        return self.client._call("tableExists", self.table_name(table))
+
+    def split_keys_from_table(self, table: str) -> List[bytes]:
+        """
+        已有表当前的 region 划分，即除第一个 region 外各 region 的起始 row_key，
+        可以用于按相同的划分创建新表
+
+        :param table:
+        :return:
+        """
+        locations = self.client._call("getAllRegionLocations", table.encode())
+        return normalize_split_keys(
+            location.regionInfo.startKey for location in locations
+        )
+
+    def create_table(
+        self,
+        table: str,
+        families: List[Union[str, dict, TColumnFamilyDescriptor]],
+        split_keys: Iterable[Union[str, bytes]] = None,
+        durability: Union[int, str] = None,
+        exist_ok: bool = False,
+    ) -> bool:
+        """
+        创建预分区的表，返回是否新建了表
+
+        :param table:
+        :param families: column family 名称、family_descriptor 参数字典
+                或 TColumnFamilyDescriptor
+        :param split_keys: 分割点，
+                见 split_keys_from_sample/split_keys_from_salt/split_keys_from_table
+        :param durability: 表级默认的 TDurability，值或名称
+        :param exist_ok: 表已存在时是否直接返回 False，否则抛出服务端的异常
+        :return:
+        """
+        if exist_ok and self.table_exists(table):
+            return False
+        columns = []
+        for family in families:
+            if isinstance(family, str):
+                family = self.family_descriptor(family)
+            elif isinstance(family, dict):
+                family = self.family_descriptor(**family)
+            columns.append(family)
+        desc = TTableDescriptor(
+            tableName=self.table_name(table),
+            columns=columns,
+            durability=HBaseClient.parse_durability(durability),
+        )
+        split_keys = normalize_split_keys(split_keys or [])
+        self.client._call("createTable", desc, split_keys or None)
+        return True
+
+    def create_tables(
+        self, tables: Dict[str, dict], exist_ok: bool = True
+    ) -> Dict[str, bool]:
+        """
+        批量创建表，返回 {<table>: 是否新建}
+
+        :param tables: {<table>: create_table 的参数字典}，如
+                {"events": {"families": ["d"], "split_keys": split_keys_from_salt(16)}}
+        :param exist_ok: 同 create_table
+        :return:
+        """
+        return {
+            table: self.create_table(table, exist_ok=exist_ok, **options)
+            for table, options in tables.items()
+        }
+
+
+if __name__ == "__main__":
+    with HBaseClient("localhost", 9090) as hc:
+        admin = HBaseAdmin(hc)
+
+        # 16 salt buckets, one region each
+        admin.create_table(
+            "YOUR_EVENT_TABLE",
+            [{"name": "d", "compression": "SNAPPY", "bloom_filter": "ROW"}],
+            split_keys=split_keys_from_salt(16),
+            exist_ok=True,
+        )
+        print(
+            hc.put_row("YOUR_EVENT_TABLE", salt_key("event_01", 16), {"d": {"v": "1"}})
+        )
+
+        # split points from the keys of the file to import
+        with open("YOUR_FILE.csv") as f:
+            next(f)
+            keys = split_keys_from_sample((line.split(",", 1)[0] for line in f), 32)
+        admin.create_table("YOUR_TABLE_NAME", ["cf01"], split_keys=keys, exist_ok=True)
+
+        # same regions as an existing table
+        admin.create_tables(
+            {
+                "YOUR_TABLE_NAME_COPY": {
+                    "families": ["cf01"],
+                    "split_keys": admin.split_keys_from_table("YOUR_TABLE_NAME"),
+                }
+            }
+        )
@@ -0,0 +1,706 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Author : Sz
+@Project: rtg-tools
+@File   : hbase_fake.py
+@Time   : 2020/10/21 0021 09:40
+"""
+import bisect
+import itertools
+import random
+import re
+import socket
+import threading
+import time
+from typing import List, Optional, Tuple, Union
+
+from thrift.protocol import TBinaryProtocol
+from thrift.transport import TSocket, TTransport
+from thrift.transport.TTransport import TTransportException
+
+from hbase.hbase_client import THBaseService
+from hbase.hbase_client.ttypes import (
+    TColumnValue,
+    TDeleteType,
+    THRegionInfo,
+    THRegionLocation,
+    TIllegalArgument,
+    TIOError,
+    TResult,
+    TServerName,
+    TTableDescriptor,
+    TTableName,
+)
+
+_PREFIX_FILTER = re.compile(r"^\s*PrefixFilter\s*\(\s*'(.*)'\s*\)\s*$", re.S)
+
+
+def table_name_bytes(table_name: TTableName) -> bytes:
+    """
+    TTableName 转换为 DML 接口中使用的表名，即 <namespace>:<qualifier>，默认命名空间省略
+    """
+    if table_name.ns and table_name.ns != b"default":
+        return table_name.ns + b":" + table_name.qualifier
+    return table_name.qualifier
+
+
+class FakeTable(object):
+    """
+    内存中的表，行键有序排列，每个单元格保存多个版本 [(timestamp, value), ...]，新版本在前
+    """
+
+    def __init__(
+        self, name: bytes, max_versions: int = 3, split_keys: List[bytes] = None
+    ):
+        self.name = name
+        self.max_versions = max_versions
+        self.split_keys = sorted(split_keys or [])
+        self.families = {}
+        self.enabled = True
+        self.keys = []
+        # {row: {(family, qualifier): [(timestamp, value), ...]}}
+        self.rows = {}
+
+    def put(
+        self, row: bytes, family: bytes, qualifier: bytes, timestamp: int, value: bytes
+    ):
+        cells = self.rows.get(row)
+        if cells is None:
+            cells = self.rows[row] = {}
+            bisect.insort(self.keys, row)
+        versions = cells.setdefault((family, qualifier), [])
+        for i, (ts, _) in enumerate(versions):
+            if ts == timestamp:
+                versions[i] = (timestamp, value)
+                return
+            if ts < timestamp:
+                versions.insert(i, (timestamp, value))
+                break
+        else:
+            versions.append((timestamp, value))
+        del versions[self.families.get(family, self.max_versions):]
+
+    def remove_row(self, row: bytes):
+        if self.rows.pop(row, None) is not None:
+            del self.keys[bisect.bisect_left(self.keys, row)]
+
+    def compact_row(self, row: bytes):
+        """
+        删除空的单元格，整行为空时删除该行
+        """
+        cells = self.rows.get(row)
+        if cells is None:
+            return
+        for column in [c for c, versions in cells.items() if not versions]:
+            del cells[column]
+        if not cells:
+            self.remove_row(row)
+
+
+class FakeHBaseHandler(THBaseService.Iface):
+    """
+    THBaseService.Iface 的内存实现，用于测试和基准测试，
+    支持的操作：
+        - exists/existsAll/get/getMultiple/put/putMultiple/deleteSingle/deleteMultiple
+        - openScanner/getScannerRows/closeScanner/getScannerResults，
+          支持 startRow/stopRow/columns/maxVersions/timeRange/batchSize/reversed/limit，
+          filterString 只支持 PrefixFilter('<prefix>')
+        - createTable/deleteTable/truncateTable/tableExists/enableTable/disableTable
+          等简单 DDL
+        - getRegionLocation/getAllRegionLocations，region 按建表时的 split keys 划分
+    其他方法未实现。
+    """
+
+    def __init__(
+        self,
+        auto_create: bool = True,
+        max_versions: int = 3,
+        server_name: Tuple[str, int] = ("localhost", 9090),
+    ):
+        """
+        :param auto_create: 写入不存在的表时是否自动建表，否则与 HBase 一样抛出 TIOError
+        :param max_versions: 自动建的表每个单元格保留的版本数
+        :param server_name: getRegionLocation 返回的服务地址
+        """
+        self.auto_create = auto_create
+        self.max_versions = max_versions
+        self.server_name = server_name
+        self.tables = {}
+        self.scanners = {}
+        self._scanner_ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    # ---------- 内部工具 ----------
+
+    def _table(self, table: bytes, create: bool = False) -> FakeTable:
+        fake_table = self.tables.get(table)
+        if fake_table is None:
+            if not (create and self.auto_create):
+                raise TIOError(message="table not found: {}".format(table.decode()))
+            fake_table = self.tables[table] = FakeTable(table, self.max_versions)
+        if not fake_table.enabled:
+            raise TIOError(message="table disabled: {}".format(table.decode()))
+        return fake_table
+
+    @staticmethod
+    def _now() -> int:
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def _column_matcher(columns) -> Optional[set]:
+        if not columns:
+            return None
+        return {(c.family, c.qualifier) for c in columns}
+
+    @staticmethod
+    def _match(matcher: Optional[set], family: bytes, qualifier: bytes) -> bool:
+        return (
+            matcher is None
+            or (family, qualifier) in matcher
+            or (family, None) in matcher
+        )
+
+    def _read_row(
+        self,
+        fake_table: FakeTable,
+        row: bytes,
+        columns=None,
+        timestamp: int = None,
+        time_range=None,
+        max_versions: int = None,
+    ) -> List[TColumnValue]:
+        cells = fake_table.rows.get(row)
+        if not cells:
+            return []
+        matcher = self._column_matcher(columns)
+        max_versions = max_versions or 1
+        column_values = []
+        for (family, qualifier) in sorted(cells):
+            if not self._match(matcher, family, qualifier):
+                continue
+            n = 0
+            for ts, value in cells[(family, qualifier)]:
+                if timestamp is not None and ts != timestamp:
+                    continue
+                if time_range is not None and not (
+                    time_range.minStamp <= ts < time_range.maxStamp
+                ):
+                    continue
+                column_values.append(
+                    TColumnValue(family, qualifier, value, timestamp=ts)
+                )
+                n += 1
+                if n >= max_versions:
+                    break
+        return column_values
+
+    def _get(self, table: bytes, tget) -> TResult:
+        fake_table = self._table(table)
+        column_values = self._read_row(
+            fake_table,
+            tget.row,
+            tget.columns,
+            tget.timestamp,
+            tget.timeRange,
+            tget.maxVersions,
+        )
+        if not column_values:
+            return TResult(columnValues=[])
+        return TResult(row=tget.row, columnValues=column_values)
+
+    def _put(self, table: bytes, tput):
+        fake_table = self._table(table, create=True)
+        now = self._now()
+        for column in tput.columnValues:
+            timestamp = column.timestamp or tput.timestamp or now
+            fake_table.put(
+                tput.row,
+                column.family,
+                column.qualifier,
+                timestamp,
+                bytes(column.value),
+            )
+
+    def _delete(self, table: bytes, tdelete):
+        fake_table = self._table(table)
+        cells = fake_table.rows.get(tdelete.row)
+        if cells is None:
+            return
+        if not tdelete.columns:
+            if tdelete.timestamp is None:
+                fake_table.remove_row(tdelete.row)
+                return
+            for versions in cells.values():
+                versions[:] = [v for v in versions if v[0] > tdelete.timestamp]
+            fake_table.compact_row(tdelete.row)
+            return
+
+        for column in tdelete.columns:
+            timestamp = (
+                column.timestamp if column.timestamp is not None else tdelete.timestamp
+            )
+            for (family, qualifier), versions in cells.items():
+                if family != column.family:
+                    continue
+                if column.qualifier is None or tdelete.deleteType in (
+                    TDeleteType.DELETE_FAMILY,
+                    TDeleteType.DELETE_FAMILY_VERSION,
+                ):
+                    versions[:] = [
+                        v
+                        for v in versions
+                        if timestamp is not None and v[0] > timestamp
+                    ]
+                elif qualifier != column.qualifier:
+                    continue
+                elif tdelete.deleteType == TDeleteType.DELETE_COLUMN:
+                    if timestamp is None:
+                        del versions[:1]
+                    else:
+                        versions[:] = [v for v in versions if v[0] != timestamp]
+                else:
+                    versions[:] = [
+                        v
+                        for v in versions
+                        if timestamp is not None and v[0] > timestamp
+                    ]
+        fake_table.compact_row(tdelete.row)
+
+    @staticmethod
+    def _parse_filter(filter_string: Optional[bytes]) -> Optional[bytes]:
+        if not filter_string:
+            return None
+        matched = _PREFIX_FILTER.match(filter_string.decode())
+        if not matched:
+            raise TIllegalArgument(
+                message="unsupported filter: {}".format(filter_string.decode())
+            )
+        return matched.group(1).encode()
+
+    def _scan_rows(self, state: dict, num_rows: int) -> List[TResult]:
+        fake_table = self._table(state["table"])
+        tscan = state["scan"]
+        keys = fake_table.keys
+        results = []
+
+        # 上一次按 batchSize 拆分后还没有返回的部分
+        while state["pending"] and len(results) < num_rows:
+            results.append(state["pending"].pop(0))
+
+        while len(results) < num_rows and not state["done"]:
+            if tscan.limit and state["count"] >= tscan.limit:
+                state["done"] = True
+                break
+            last = state["last"]
+            if tscan.reversed:
+                if last is not None:
+                    index = bisect.bisect_left(keys, last) - 1
+                elif tscan.startRow:
+                    index = bisect.bisect_right(keys, tscan.startRow) - 1
+                else:
+                    index = len(keys) - 1
+                if index < 0 or (tscan.stopRow and keys[index] <= tscan.stopRow):
+                    state["done"] = True
+                    break
+            else:
+                if last is not None:
+                    index = bisect.bisect_right(keys, last)
+                else:
+                    index = bisect.bisect_left(keys, tscan.startRow or b"")
+                if index >= len(keys) or (
+                    tscan.stopRow and keys[index] >= tscan.stopRow
+                ):
+                    state["done"] = True
+                    break
+
+            row = keys[index]
+            state["last"] = row
+            if state["prefix"] is not None and not row.startswith(state["prefix"]):
+                continue
+            column_values = self._read_row(
+                fake_table,
+                row,
+                tscan.columns,
+                None,
+                tscan.timeRange,
+                tscan.maxVersions,
+            )
+            if not column_values:
+                continue
+            state["count"] += 1
+            if tscan.batchSize and len(column_values) > tscan.batchSize:
+                size = tscan.batchSize
+                chunks = [
+                    column_values[i : i + size]
+                    for i in range(0, len(column_values), size)
+                ]
+                parts = [
+                    TResult(row=row, columnValues=chunk, partial=i < len(chunks) - 1)
+                    for i, chunk in enumerate(chunks)
+                ]
+                state["pending"].extend(parts)
+                while state["pending"] and len(results) < num_rows:
+                    results.append(state["pending"].pop(0))
+            else:
+                results.append(TResult(row=row, columnValues=column_values))
+        return results
+
+    def _open_scanner(self, table: bytes, tscan) -> dict:
+        self._table(table)
+        return {
+            "table": table,
+            "scan": tscan,
+            "prefix": self._parse_filter(tscan.filterString),
+            "last": None,
+            "count": 0,
+            "pending": [],
+            "done": False,
+        }
+
+    def _region_locations(self, fake_table: FakeTable) -> List[THRegionLocation]:
+        bounds = [b""] + fake_table.split_keys + [b""]
+        host, port = self.server_name
+        locations = []
+        for i in range(len(bounds) - 1):
+            locations.append(
+                THRegionLocation(
+                    serverName=TServerName(hostName=host, port=port, startCode=1),
+                    regionInfo=THRegionInfo(
+                        regionId=i + 1,
+                        tableName=fake_table.name,
+                        startKey=bounds[i],
+                        endKey=bounds[i + 1],
+                        offline=False,
+                        split=False,
+                        replicaId=0,
+                    ),
+                )
+            )
+        return locations
+
+    # ---------- DML ----------
+
+    def exists(self, table, tget):
+        with self._lock:
+            return bool(self._get(table, tget).columnValues)
+
+    def existsAll(self, table, tgets):
+        with self._lock:
+            return [bool(self._get(table, tget).columnValues) for tget in tgets]
+
+    def get(self, table, tget):
+        with self._lock:
+            return self._get(table, tget)
+
+    def getMultiple(self, table, tgets):
+        with self._lock:
+            return [self._get(table, tget) for tget in tgets]
+
+    def put(self, table, tput):
+        with self._lock:
+            self._put(table, tput)
+
+    def putMultiple(self, table, tputs):
+        with self._lock:
+            for tput in tputs:
+                self._put(table, tput)
+
+    def deleteSingle(self, table, tdelete):
+        with self._lock:
+            self._delete(table, tdelete)
+
+    def deleteMultiple(self, table, tdeletes):
+        with self._lock:
+            for tdelete in tdeletes:
+                self._delete(table, tdelete)
+            return []
+
+    def openScanner(self, table, tscan):
+        with self._lock:
+            scanner_id = next(self._scanner_ids)
+            self.scanners[scanner_id] = self._open_scanner(table, tscan)
+            return scanner_id
+
+    def getScannerRows(self, scannerId, numRows):
+        with self._lock:
+            state = self.scanners.get(scannerId)
+            if state is None:
+                raise TIllegalArgument(
+                    message="invalid scanner id: {}".format(scannerId)
+                )
+            return self._scan_rows(state, numRows)
+
+    def closeScanner(self, scannerId):
+        with self._lock:
+            if self.scanners.pop(scannerId, None) is None:
+                raise TIllegalArgument(
+                    message="invalid scanner id: {}".format(scannerId)
+                )
+
+    def getScannerResults(self, table, tscan, numRows):
+        with self._lock:
+            return self._scan_rows(self._open_scanner(table, tscan), numRows)
+
+    # ---------- DDL ----------
+
+    def getRegionLocation(self, table, row, reload):
+        with self._lock:
+            fake_table = self._table(table)
+            index = bisect.bisect_right(fake_table.split_keys, row)
+            return self._region_locations(fake_table)[index]
+
+    def getAllRegionLocations(self, table):
+        with self._lock:
+            return self._region_locations(self._table(table))
+
+    def tableExists(self, tableName):
+        with self._lock:
+            return table_name_bytes(tableName) in self.tables
+
+    def createTable(self, desc, splitKeys):
+        with self._lock:
+            name = table_name_bytes(desc.tableName)
+            if name in self.tables:
+                raise TIOError(message="table already exists: {}".format(name.decode()))
+            fake_table = FakeTable(name, self.max_versions, splitKeys)
+            for column in desc.columns or []:
+                fake_table.families[column.name] = (
+                    column.maxVersions or self.max_versions
+                )
+            self.tables[name] = fake_table
+
+    def deleteTable(self, tableName):
+        with self._lock:
+            name = table_name_bytes(tableName)
+            if self.tables.pop(name, None) is None:
+                raise TIOError(message="table not found: {}".format(name.decode()))
+
+    def truncateTable(self, tableName, preserveSplits):
+        with self._lock:
+            old = self.tables[table_name_bytes(tableName)]
+            new = FakeTable(
+                old.name, old.max_versions, old.split_keys if preserveSplits else None
+            )
+            new.families = old.families
+            self.tables[old.name] = new
+
+    def enableTable(self, tableName):
+        with self._lock:
+            self.tables[table_name_bytes(tableName)].enabled = True
+
+    def disableTable(self, tableName):
+        with self._lock:
+            self.tables[table_name_bytes(tableName)].enabled = False
+
+    def isTableEnabled(self, tableName):
+        with self._lock:
+            return self.tables[table_name_bytes(tableName)].enabled
+
+    def isTableDisabled(self, tableName):
+        return not self.isTableEnabled(tableName)
+
+    def isTableAvailable(self, tableName):
+        return self.tableExists(tableName)
+
+    def getTableDescriptor(self, table):
+        with self._lock:
+            name = table_name_bytes(table)
+            if name not in self.tables:
+                raise TIOError(message="table not found: {}".format(name.decode()))
+            return TTableDescriptor(tableName=table)
+
+
+class _FaultInjector(object):
+    """
+    包装 handler，在每次调用前注入延迟和故障
+    """
+
+    def __init__(self, handler: FakeHBaseHandler, server: "FakeHBaseServer"):
+        self._handler = handler
+        self._server = server
+
+    def __getattr__(self, name: str):
+        func = getattr(self._handler, name)
+
+        def _wrapper(*args):
+            self._server.inject()
+            return func(*args)
+
+        return _wrapper
+
+
+class FakeHBaseServer(object):
+    """
+    在本地端口上运行 FakeHBaseHandler 的 Thrift 服务（TBufferedTransport + TBinaryProtocol，
+    与 HBase Thrift2 网关的默认配置相同），每个连接一个线程，
+    可以注入固定延迟、随机抖动和故障：
+        - failure_mode='error': 返回 TIOError，连接保持可用
+        - failure_mode='disconnect': 直接断开连接，客户端会收到传输层异常
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        handler: FakeHBaseHandler = None,
+        latency: Union[int, float] = 0,
+        jitter: Union[int, float] = 0,
+        failure_rate: float = 0,
+        failure_mode: str = "error",
+        seed: int = None,
+    ):
+        """
+        :param host:
+        :param port: 0 表示随机选择可用端口，启动后通过 self.port 获取
+        :param handler: 多个服务共享同一个 handler 即可模拟同一集群的多个网关
+        :param latency: 每次调用的固定延迟，秒
+        :param jitter: 在固定延迟上额外增加 [0, jitter) 的随机延迟，秒
+        :param failure_rate: 每次调用失败的概率
+        :param failure_mode: error/disconnect
+        :param seed: 随机数种子，用于复现
+        """
+        if failure_mode not in ("error", "disconnect"):
+            raise ValueError("unsupported failure mode: {}".format(failure_mode))
+        self.host = host
+        self.port = port
+        self.handler = handler or FakeHBaseHandler(server_name=(host, port))
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_mode = failure_mode
+        self.calls = 0
+        self.failures = 0
+
+        self._random = random.Random(seed)
+        self._processor = THBaseService.Processor(_FaultInjector(self.handler, self))
+        self._server_socket = None
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    @property
+    def address(self) -> str:
+        return "{}:{}".format(self.host, self.port)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def inject(self):
+        """
+        在 handler 执行前调用，按配置注入延迟和故障
+
+        :return:
+        """
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (
+                self._random.random() * self.jitter if self.jitter else 0
+            )
+            failed = self.failure_rate and self._random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            if self.failure_mode == "disconnect":
+                raise TTransportException(
+                    TTransportException.END_OF_FILE, "injected disconnect"
+                )
+            raise TIOError(message="injected failure")
+
+    def start(self) -> "FakeHBaseServer":
+        self._stopped.clear()
+        self._server_socket = TSocket.TServerSocket(self.host, self.port)
+        self._server_socket.listen()
+        self.port = self._server_socket.handle.getsockname()[1]
+        if self.handler.server_name[1] == 0:
+            self.handler.server_name = (self.host, self.port)
+        threading.Thread(
+            target=self._serve, name="fake-hbase-server", daemon=True
+        ).start()
+        return self
+
+    def stop(self):
+        """
+        停止服务并断开所有连接，之后可以再次 start，端口不变
+
+        :return:
+        """
+        self._stopped.set()
+        if self._server_socket is not None:
+            # 先 shutdown 唤醒阻塞在 accept 上的线程，否则端口不会被释放
+            try:
+                self._server_socket.handle.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._server_socket.close()
+        with self._lock:
+            clients, self._clients = self._clients, set()
+        # 只 shutdown，由处理线程读到连接关闭后自己 close，
+        # 直接 close 会把 handle 置为 None，正在读取的线程会抛出 AttributeError
+        for client in clients:
+            try:
+                client.handle.shutdown(socket.SHUT_RDWR)
+            except (AttributeError, OSError):
+                pass
+
+    def _serve(self):
+        while not self._stopped.is_set():
+            try:
+                client = self._server_socket.accept()
+            except (OSError, TTransportException):
+                if self._stopped.is_set():
+                    return
+                continue
+            if client is None:
+                continue
+            with self._lock:
+                self._clients.add(client)
+            threading.Thread(target=self._handle, args=(client,), daemon=True).start()
+
+    def _handle(self, client: TSocket.TSocket):
+        itrans = TTransport.TBufferedTransport(client)
+        otrans = TTransport.TBufferedTransport(client)
+        iprot = TBinaryProtocol.TBinaryProtocol(itrans)
+        oprot = TBinaryProtocol.TBinaryProtocol(otrans)
+        try:
+            while not self._stopped.is_set():
+                self._processor.process(iprot, oprot)
+        except (TTransportException, OSError):
+            pass
+        except AttributeError:
+            # 停止时 socket 已被关闭
+            if not self._stopped.is_set():
+                raise
+        finally:
+            with self._lock:
+                self._clients.discard(client)
+            client.close()
+
+
+def start_cluster(gateways: int = 2, **kwargs) -> List[FakeHBaseServer]:
+    """
+    启动共享同一份数据的多个网关
+
+    :param gateways: 网关数量
+    :param kwargs: 传给每个 FakeHBaseServer 的参数
+    :return:
+    """
+    handler = kwargs.pop("handler", None) or FakeHBaseHandler()
+    return [FakeHBaseServer(handler=handler, **kwargs).start() for _ in range(gateways)]
+
+
+if __name__ == "__main__":
+    from hbase.hbase_tools import HBaseClient
+
+    servers = start_cluster(2, latency=0.001)
+    with HBaseClient([s.address for s in servers]) as hc:
+        hc.put_row("test_table", "row_key_01", {"cf01": {"ck01": "cv01"}})
+        print(hc.get_row("test_table", "row_key_01"))
+        print(list(hc.scan_row("test_table")))
+    for server in servers:
+        server.stop()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Author : Sz
+@Project: rtg-tools
+@File   : hbase_import.py
+@Time   : 2020/10/19 0019 10:21
+"""
+import csv
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator, List, Tuple, Union
+
+from thrift.protocol import TBinaryProtocol
+
+from hbase.hbase_client.ttypes import TTransport, TPut, TResult
+from hbase.hbase_tools import HBaseClient, read_checkpoint, write_checkpoint
+
+
+class HBaseImporter(object):
+    """
+    从文件向 HBase 批量导入数据的工具，
+    分块读取文件，由线程池中的多个连接通过 putMultiple 并发写入，
+    同时在途批次数量有上限，写入跟不上时会阻塞读取（背压）；
+    导入进度以文件字节偏移量的形式记录在检查点文件中，崩溃后可以从断点继续。
+
+    支持的文件格式：
+        - jsonl: 每行一个 get_row 返回格式的 json，即 {"row_key": ..., <cf>: {<q>: <v>}}
+        - csv: 第一行为表头，row_key 列为行键，其余列名为 <cf>:<q>，每条记录不能跨行
+        - thrift: 以 TBinaryProtocol 连续序列化的 TResult（如扫描导出的结果）
+    """
+
+    def __init__(
+        self,
+        hbase_host: str,
+        hbase_port: int,
+        workers: int = 4,
+        batch_size: int = 1000,
+        max_in_flight: int = None,
+        max_retry: int = 3,
+        **kwargs,
+    ):
+        """
+        :param hbase_host:
+        :param hbase_port:
+        :param workers: 写入线程数，每个线程持有自己的连接
+        :param batch_size: 每次 putMultiple 写入的行数
+        :param max_in_flight: 同时在途（已读取、未写完）的最大批次数，默认为 workers 的两倍
+        :param max_retry: 单个批次写入失败时的最大重试次数
+        :param kwargs: 其他传给 HBaseClient 的参数
+        """
+        self.hbase_host = hbase_host
+        self.hbase_port = hbase_port
+        self.client_kwargs = kwargs
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight or workers * 2
+        self.max_retry = max_retry
+
+        self._local = threading.local()
+        self._clients = []
+        self._clients_lock = threading.Lock()
+
+    def _get_client(self) -> HBaseClient:
+        """
+        获取当前线程专用的连接，Thrift 的连接不是线程安全的
+
+        :return:
+        """
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = HBaseClient(self.hbase_host, self.hbase_port, **self.client_kwargs)
+            self._local.client = client
+            with self._clients_lock:
+                self._clients.append(client)
+        return client
+
+    def close(self):
+        with self._clients_lock:
+            for client in self._clients:
+                client.close()
+            self._clients.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def read_checkpoint(checkpoint: str) -> int:
+        """
+        读取检查点文件中记录的字节偏移量，文件不存在时从头开始
+
+        :param checkpoint:
+        :return:
+        """
+        return read_checkpoint(checkpoint) or 0
+
+    @staticmethod
+    def write_checkpoint(checkpoint: str, offset: int):
+        """
+        原子地写入检查点，见 hbase_tools.write_checkpoint
+
+        :param checkpoint:
+        :param offset:
+        :return:
+        """
+        write_checkpoint(checkpoint, offset)
+
+    @staticmethod
+    def read_jsonl(f, offset: int) -> Generator:
+        """
+        逐行读取 jsonl 文件，生成 (row_key, row_value, 该行结束处的偏移量)
+
+        :param f: 以二进制方式打开的文件
+        :param offset: 开始读取的偏移量
+        :return:
+        """
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            yield record.pop("row_key"), record, offset
+
+    @staticmethod
+    def read_csv(f, offset: int, encoding: str = "utf-8") -> Generator:
+        """
+        逐行读取 csv 文件，生成 (row_key, row_value, 该行结束处的偏移量)，
+        空字符串的单元格不会被写入
+
+        :param f: 以二进制方式打开的文件
+        :param offset: 开始读取的偏移量，小于表头长度时从表头之后开始
+        :param encoding:
+        :return:
+        """
+        f.seek(0)
+        header_line = f.readline()
+        header = next(csv.reader([header_line.decode(encoding)]))
+        columns = [
+            tuple(column.split(":", 1)) if column != "row_key" else None
+            for column in header
+        ]
+        offset = max(offset, len(header_line))
+
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            if not line.strip():
+                continue
+            cells = next(csv.reader([line.decode(encoding)]))
+            row_key, row_value = None, {}
+            for column, cell in zip(columns, cells):
+                if column is None:
+                    row_key = cell
+                elif cell != "":
+                    row_value.setdefault(column[0], {})[column[1]] = cell
+            yield row_key, row_value, offset
+
+    @staticmethod
+    def read_thrift(f, offset: int) -> Generator:
+        """
+        读取连续序列化的 TResult，生成 (TPut, 该条记录结束处的偏移量)，
+        原始的 timestamp 会被保留
+
+        :param f: 以二进制方式打开的文件
+        :param offset: 开始读取的偏移量
+        :return:
+        """
+        file_size = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        protocol = TBinaryProtocol.TBinaryProtocol(TTransport.TFileObjectTransport(f))
+        while f.tell() < file_size:
+            result = TResult()
+            result.read(protocol)
+            yield TPut(result.row, result.columnValues), f.tell()
+
+    def read_records(self, file_path: str, file_format: str, offset: int) -> Generator:
+        """
+        按文件格式读取记录，统一生成 (TPut 或 (row_key, row_value), 偏移量)
+
+        :param file_path:
+        :param file_format: jsonl/csv/thrift
+        :param offset:
+        :return:
+        """
+        with open(file_path, "rb") as f:
+            if file_format == "thrift":
+                yield from self.read_thrift(f, offset)
+                return
+
+            if file_format == "jsonl":
+                reader = self.read_jsonl(f, offset)
+            elif file_format == "csv":
+                reader = self.read_csv(f, offset)
+            else:
+                raise ValueError("unsupported file format: {}".format(file_format))
+
+            for row_key, row_value, end_offset in reader:
+                yield (row_key, row_value), end_offset
+
+    def _put_batch(
+        self,
+        table: str,
+        batch: List[Union[TPut, Tuple[str, dict]]],
+        durability: Union[int, str] = None,
+    ) -> int:
+        """
+        在工作线程中编码并写入一个批次，重试后仍失败则抛出异常
+
+        :param table:
+        :param batch:
+        :param durability:
+        :return:
+        """
+        # 通过连接编码，client_kwargs 中注册的 schemas 才会生效
+        client = self._get_client()
+        t_puts = [
+            (
+                record
+                if isinstance(record, TPut)
+                else TPut(record[0].encode(), client.encode_row(table, record[1]))
+            )
+            for record in batch
+        ]
+        for _ in range(self.max_retry):
+            client = self._get_client()
+            if client.put_rows(table, t_puts, durability=durability) is not None:
+                return len(t_puts)
+            # 连接可能已经失效，丢弃后下次重试使用新连接
+            client.close()
+            self._local.client = None
+        raise IOError("failed to put {} rows into {}".format(len(t_puts), table))
+
+    def import_file(
+        self,
+        table: str,
+        file_path: str,
+        file_format: str = "jsonl",
+        checkpoint: str = None,
+        durability: Union[int, str] = None,
+    ) -> int:
+        """
+        将文件导入到 table 中，返回本次导入的行数。
+        指定 checkpoint 时会从其中记录的偏移量继续导入，
+        并且只有当某个偏移量之前的所有批次都写入成功后才会推进检查点。
+
+        :param table:
+        :param file_path:
+        :param file_format: jsonl/csv/thrift
+        :param checkpoint: 检查点文件路径
+        :param durability: 写入使用的 TDurability，可以导入失败后整体重导的数据适合使用 SKIP_WAL
+        :return:
+        """
+        start_offset = self.read_checkpoint(checkpoint)
+        in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        state_lock = threading.Lock()
+        # 已完成但前面还有未完成批次的 {批次序号: 结束偏移量}
+        finished = {}
+        state = {"next_seq": 0, "rows": 0, "error": None}
+
+        def on_done(seq: int, end_offset: int, future):
+            try:
+                error = future.exception()
+                with state_lock:
+                    if error is not None:
+                        state["error"] = state["error"] or error
+                        return
+                    state["rows"] += future.result()
+                    finished[seq] = end_offset
+                    # 只推进到连续完成的位置
+                    committed = None
+                    while state["next_seq"] in finished:
+                        committed = finished.pop(state["next_seq"])
+                        state["next_seq"] += 1
+                    if committed is not None and checkpoint:
+                        self.write_checkpoint(checkpoint, committed)
+            finally:
+                in_flight.release()
+
+        def submit(seq: int, batch: list, end_offset: int):
+            in_flight.acquire()
+            future = executor.submit(self._put_batch, table, batch, durability)
+            future.add_done_callback(lambda fu: on_done(seq, end_offset, fu))
+
+        seq = 0
+        batch = []
+        end_offset = start_offset
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for record, end_offset in self.read_records(
+                file_path, file_format, start_offset
+            ):
+                batch.append(record)
+                if len(batch) >= self.batch_size:
+                    submit(seq, batch, end_offset)
+                    seq += 1
+                    batch = []
+                if state["error"] is not None:
+                    break
+            if batch and state["error"] is None:
+                submit(seq, batch, end_offset)
+
+        if state["error"] is not None:
+            raise state["error"]
+        return state["rows"]
+
+
+if __name__ == "__main__":
+    with HBaseImporter("localhost", 9090, workers=8, batch_size=500) as importer:
+        imported = importer.import_file(
+            "YOUR_TABLE_NAME",
+            "YOUR_FILE.jsonl",
+            file_format="jsonl",
+            checkpoint="YOUR_FILE.jsonl.checkpoint",
+            durability="ASYNC_WAL",
+        )
+        print(imported)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Author : Sz
+@Project: rtg-tools
+@File   : hbase_index.py
+@Time   : 2020/10/23 0023 09:52
+"""
+import time
+from collections import namedtuple
+from typing import Dict, List, Tuple, Union
+
+from hbase.hbase_client.ttypes import TColumn, TColumnValue, TDelete, TGet, TPut, TScan
+from hbase.hbase_tools import HBaseClient, retry
+
+# 索引定义，column 为 (family bytes, qualifier bytes)
+Index = namedtuple("Index", ["name", "column", "index_table"])
+
+# 索引表中行键的格式为 <转义后的列值><SEPARATOR><数据表 row_key>，
+# 列值中的 \x00 转义为 ESCAPED，转义后的列值中不会出现 SEPARATOR，行键可以无歧义地拆分，
+# 列值 a 的索引项也不会匹配到列值 a\x00b 的索引项；转义保持字节序，同一列值的索引项仍然连续
+SEPARATOR = b"\x00\x01"
+ESCAPED = b"\x00\xff"
+
+
+def index_key(value: bytes, row: bytes) -> bytes:
+    """
+    索引表的行键
+
+    :param value: 编码后的列值
+    :param row: 数据表的 row_key
+    :return:
+    """
+    return value.replace(b"\x00", ESCAPED) + SEPARATOR + row
+
+
+def parse_index_key(key: bytes) -> Tuple[bytes, bytes]:
+    """
+    将索引表的行键拆分为 (列值, row_key)，格式不正确时抛出 ValueError
+
+    :param key:
+    :return:
+    """
+    value, separator, row = key.partition(SEPARATOR)
+    if not separator or b"\x00" in value.replace(ESCAPED, b""):
+        raise ValueError("malformed index key: {!r}".format(key))
+    return value.replace(ESCAPED, b"\x00"), row
+
+
+class IndexManager(object):
+    """
+    HBase 二级索引维护工具，
+    通过 IndexManager 写入/删除数据时同步维护索引表，按列值查询时先扫描索引表得到 row_key，
+    再通过 getMultiple 批量取回数据行，查询代价与匹配的行数成正比，而不是整张表。
+
+    索引表的行键为 <转义后的列值>\\x00\\x01<row_key>（见 index_key），只包含一个空的单元格 <family>:r，
+    索引表需要事先建好（column family 与 family 参数一致）。
+
+    HBase 不支持跨表事务，写入顺序为：写入新索引 -> 写入数据 -> 重新读取数据行 -> 删除旧索引，
+    删除前重新读取是为了跳过期间被并发写入改回旧值的行，中途失败时只会留下多余的索引项；
+    但重新读取与删除之间仍有很短的窗口，并发修改同一行时索引项可能丢失，
+    对同一行有并发写入时需要定期通过 rebuild 补建索引。
+    查询时会校验数据行中的列值，过滤掉多余的索引项（repair 为 True 时顺便删除超过 repair_grace 的）。
+    """
+
+    def __init__(self, client: HBaseClient, family: str = "i"):
+        """
+        :param client:
+        :param family: 索引表的 column family
+        """
+        self.client = client
+        self.family = family.encode()
+        # {table: {index name: Index}}
+        self.indexes = {}
+
+    def add_index(
+        self, table: str, name: str, column: str, index_table: str = None
+    ) -> Index:
+        """
+        为 table 的 column 列声明索引，已有数据需要通过 rebuild 补建索引
+
+        :param table:
+        :param name: 索引名
+        :param column: <family>:<qualifier>
+        :param index_table: 索引表名，默认为 <table>_idx_<name>
+        :return:
+        """
+        family, qualifier = column.split(":", 1)
+        index = Index(
+            name,
+            (family.encode(), qualifier.encode()),
+            index_table or "{}_idx_{}".format(table, name),
+        )
+        self.indexes.setdefault(table, {})[name] = index
+        return index
+
+    def _encode_value(self, table: str, index: Index, value, typed: bool) -> bytes:
+        """
+        按数据表写入时的方式编码列值，保证与索引表中的值一致
+        """
+        family, qualifier = index.column
+        row_value = {family.decode(): {qualifier.decode(): value}}
+        return self.client.encode_row(table, row_value, typed)[0].value
+
+    def _get_indexed(
+        self, table: str, row_keys: List[bytes], indexes: List[Index]
+    ) -> List[Dict[Tuple[bytes, bytes], bytes]]:
+        """
+        批量读取 row_keys 当前被索引的列值
+        """
+        columns = [TColumn(*index.column) for index in indexes]
+        gets = [TGet(row=row_key, columns=columns) for row_key in row_keys]
+        rows_data = self.client._call("getMultiple", table.encode(), gets)
+        return [
+            {(c.family, c.qualifier): c.value for c in row_data.columnValues}
+            for row_data in rows_data
+        ]
+
+    def _put_index(self, entries: Dict[str, List[bytes]], durability: int = None):
+        for index_table, keys in entries.items():
+            t_puts = [
+                TPut(key, [TColumnValue(self.family, b"r", b"")], durability=durability)
+                for key in keys
+            ]
+            self.client._call("putMultiple", index_table.encode(), t_puts)
+
+    def _del_index(self, entries: Dict[str, List[bytes]]):
+        for index_table, keys in entries.items():
+            t_deletes = [TDelete(row=key) for key in keys]
+            self.client._call("deleteMultiple", index_table.encode(), t_deletes)
+
+    def _del_old_index(
+        self,
+        table: str,
+        indexes: List[Index],
+        candidates: List[Tuple[Index, bytes, bytes]],
+    ):
+        """
+        删除旧的索引项，删除之前重新读取数据行，
+        数据行的当前值与旧值相同时（期间有其他写入把该行改回了旧值）保留该索引项
+
+        :param table:
+        :param indexes:
+        :param candidates: [(Index, 旧的列值, row_key), ...]
+        :return:
+        """
+        if not candidates:
+            return
+        rows = sorted({row for _, _, row in candidates})
+        current = dict(zip(rows, self._get_indexed(table, rows, indexes)))
+        removed = {}
+        for index, old, row in candidates:
+            if current[row].get(index.column) == old:
+                continue
+            removed.setdefault(index.index_table, []).append(index_key(old, row))
+        self._del_index(removed)
+
+    @retry(max_retry=3, delay=1, ignore_exception=True)
+    def put_rows(
+        self,
+        table: str,
+        rows: Dict[str, Dict],
+        typed: bool = False,
+        durability: Union[int, str] = None,
+    ) -> int:
+        """
+        批量写入数据并维护索引，
+        数据通过一次 putMultiple 写入，每张索引表的新增/删除也各自合并为一次请求；
+        重试之后仍然失败时返回 None，成功时返回写入的行数
+
+        :param table:
+        :param rows: {<row_key>: <row_value>, ...}，row_value 格式同 HBaseClient.put_row
+        :param typed: 同 HBaseClient.put_row
+        :param durability: 同 HBaseClient.put_row，同时用于索引表
+        :return:
+        """
+        durability = self.client.get_durability(table, durability)
+        t_puts = [
+            TPut(
+                row_key.encode(),
+                self.client.encode_row(table, row_value, typed),
+                durability=durability,
+            )
+            for row_key, row_value in rows.items()
+        ]
+        indexes = list(self.indexes.get(table, {}).values())
+        if not indexes:
+            self.client._call("putMultiple", table.encode(), t_puts)
+            return len(t_puts)
+
+        old_rows = self._get_indexed(table, [t_put.row for t_put in t_puts], indexes)
+        added, removed = {}, []
+        for t_put, old_values in zip(t_puts, old_rows):
+            new_values = {(c.family, c.qualifier): c.value for c in t_put.columnValues}
+            for index in indexes:
+                new = new_values.get(index.column)
+                # 没有写入该列时索引不变
+                if new is None:
+                    continue
+                old = old_values.get(index.column)
+                if new == old:
+                    continue
+                added.setdefault(index.index_table, []).append(
+                    index_key(new, t_put.row)
+                )
+                if old is not None:
+                    removed.append((index, old, t_put.row))
+
+        self._put_index(added, durability)
+        self.client._call("putMultiple", table.encode(), t_puts)
+        self._del_old_index(table, indexes, removed)
+        return len(t_puts)
+
+    def put_row(
+        self,
+        table: str,
+        row_key: str,
+        row_value: Dict,
+        typed: bool = False,
+        durability: Union[int, str] = None,
+    ):
+        """
+        写入一行并维护索引，参数同 HBaseClient.put_row
+
+        :param table:
+        :param row_key:
+        :param row_value:
+        :param typed:
+        :param durability:
+        :return:
+        """
+        return self.put_rows(table, {row_key: row_value}, typed, durability)
+
+    @retry(max_retry=3, delay=1, ignore_exception=True)
+    def del_row(self, table: str, row_key: str) -> bool:
+        """
+        删除一整行及其索引项，重试之后仍然失败时返回 None
+
+        :param table:
+        :param row_key:
+        :return:
+        """
+        row = row_key.encode()
+        indexes = list(self.indexes.get(table, {}).values())
+        old_values = self._get_indexed(table, [row], indexes)[0] if indexes else {}
+        self.client._call("deleteSingle", table.encode(), TDelete(row=row))
+        removed = [
+            (index, old_values[index.column], row)
+            for index in indexes
+            if index.column in old_values
+        ]
+        self._del_old_index(table, indexes, removed)
+        return True
+
+    @retry(ignore_exception=True)
+    def get_by_index(
+        self,
+        table: str,
+        name: str,
+        value,
+        typed: bool = False,
+        limit: int = None,
+        chunk: int = 100,
+        repair: bool = False,
+        repair_grace: Union[int, float] = 60,
+    ) -> List[dict]:
+        """
+        按索引查询列值等于 value 的所有行，返回格式同 HBaseClient.get_rows，按 row_key 排序，
+        重试之后仍然失败时返回 None
+
+        :param table:
+        :param name: 索引名
+        :param value: 列值，按与写入时相同的方式编码后比较
+        :param typed: 同 HBaseClient.put_row，需要与写入时一致
+        :param limit: 最多返回的行数
+        :param chunk: 每次扫描索引表、每次 getMultiple 的行数
+        :param repair: 是否删除查询时发现的多余索引项
+        :param repair_grace: 只删除写入超过多少秒的多余索引项，
+                写入中的行在写入数据之前已经有了新的索引项，此时看起来与多余的索引项一样
+        :return:
+        """
+        index = self.indexes[table][name]
+        encoded = self._encode_value(table, index, value, typed)
+        prefix = index_key(encoded, b"")
+        t_scan = TScan(
+            startRow=prefix,
+            stopRow=HBaseClient.next_prefix(prefix),
+            columns=[TColumn(self.family)],
+        )
+        decode = self.client._decoder(table)
+
+        rows = []
+        stale = []
+        # [(row_key, 索引项的写入时间戳), ...]
+        row_keys = []
+        repair_before = int((time.time() - repair_grace) * 1000)
+
+        def resolve():
+            gets = [TGet(row=row_key) for row_key, _ in row_keys]
+            rows_data = self.client._call("getMultiple", table.encode(), gets)
+            for (row_key, written_at), row_data in zip(row_keys, rows_data):
+                current = [
+                    c.value
+                    for c in row_data.columnValues
+                    if (c.family, c.qualifier) == index.column
+                ]
+                # 数据行已被删除或列值已被修改
+                if not current or current[0] != encoded:
+                    if written_at < repair_before:
+                        stale.append(index_key(encoded, row_key))
+                    continue
+                rows.append({"row_key": row_key.decode(), **decode(row_data)})
+            row_keys.clear()
+
+        for row_info in self.client.scan_results(index.index_table, t_scan, chunk):
+            try:
+                value, row_key = parse_index_key(row_info.row)
+            except ValueError:
+                continue
+            # 只处理确实属于该列值的索引项，其他索引项既不返回也不会被 repair 删除
+            if value != encoded:
+                continue
+            row_keys.append((row_key, max(c.timestamp for c in row_info.columnValues)))
+            if len(row_keys) >= chunk:
+                resolve()
+                if limit and len(rows) >= limit:
+                    break
+        if row_keys and not (limit and len(rows) >= limit):
+            resolve()
+
+        if repair and stale:
+            self._del_index({index.index_table: stale})
+        return rows[:limit] if limit else rows
+
+    def rebuild(self, table: str, name: str, chunk: int = 1000) -> int:
+        """
+        扫描整张数据表，为已有数据补建索引，返回写入的索引项数，
+        不会删除多余的索引项
+
+        :param table:
+        :param name: 索引名
+        :param chunk: 每次扫描、每次写入索引表的行数
+        :return:
+        """
+        index = self.indexes[table][name]
+        t_scan = TScan(columns=[TColumn(*index.column)])
+        count = 0
+        keys = []
+        for row_info in self.client.scan_results(table, t_scan, chunk):
+            for column in row_info.columnValues:
+                keys.append(index_key(column.value, row_info.row))
+            if len(keys) >= chunk:
+                self._put_index({index.index_table: keys})
+                count += len(keys)
+                keys = []
+        if keys:
+            self._put_index({index.index_table: keys})
+            count += len(keys)
+        return count
+
+
+if __name__ == "__main__":
+    with HBaseClient("localhost", 9090) as hc:
+        im = IndexManager(hc)
+        im.add_index("YOUR_TABLE_NAME", "by_email", "info:email")
+
+        im.put_row("YOUR_TABLE_NAME", "user_01", {"info": {"email": "a@example.com"}})
+        im.put_rows(
+            "YOUR_TABLE_NAME",
+            {
+                "user_02": {"info": {"email": "b@example.com"}},
+                "user_03": {"info": {"email": "a@example.com"}},
+            },
+        )
+        print(im.get_by_index("YOUR_TABLE_NAME", "by_email", "a@example.com"))
+
+        im.del_row("YOUR_TABLE_NAME", "user_01")
+        print(im.get_by_index("YOUR_TABLE_NAME", "by_email", "a@example.com"))
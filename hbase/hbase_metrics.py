@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Author : Sz
+@Project: rtg-tools
+@File   : hbase_metrics.py
+@Time   : 2020/10/20 0020 11:36
+"""
+import threading
+from typing import Callable, List
+
+from thrift.transport import TSocket
+
+# Prometheus 输出的分位数及其在 Histogram.to_dict 中对应的键
+_QUANTILES = (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99"), ("0.999", "p99.9"))
+
+
+class Histogram(object):
+    """
+    HDR 风格的延迟直方图，
+    以微秒为单位记录，每个 2 的幂次区间再线性划分为 16 个桶，相对误差约 6%，
+    桶按需创建，记录一次只是一次字典更新
+    """
+
+    SUB_BUCKETS = 16
+    SUB_BUCKET_BITS = 4
+
+    def __init__(self):
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def bucket_index(cls, value: int) -> int:
+        if value < cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS - 1
+        return (shift + 1) * cls.SUB_BUCKETS + (value >> shift) - cls.SUB_BUCKETS
+
+    @classmethod
+    def bucket_value(cls, index: int) -> int:
+        """
+        桶的下界，与 bucket_index 互逆
+        """
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = index // cls.SUB_BUCKETS - 1
+        return (index % cls.SUB_BUCKETS + cls.SUB_BUCKETS) << shift
+
+    def record(self, seconds: float):
+        """
+        记录一次耗时
+
+        :param seconds: 耗时，秒
+        :return:
+        """
+        index = self.bucket_index(int(seconds * 1e6))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q: float) -> float:
+        """
+        计算分位数，返回值为所在桶的中点，单位秒
+
+        :param q: 0~100
+        :return:
+        """
+        if not self.count:
+            return 0.0
+        target = max(1, int(round(self.count * q / 100.0)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                low = self.bucket_value(index)
+                high = self.bucket_value(index + 1)
+                return min((low + high) / 2.0 / 1e6, self.max)
+        return self.max
+
+    def merge(self, other: "Histogram"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def to_dict(self, percentiles: List[float] = (50, 90, 99, 99.9)) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min or 0.0,
+            "max": self.max or 0.0,
+            "mean": self.total / self.count if self.count else 0.0,
+            **{"p{:g}".format(q): self.percentile(q) for q in percentiles},
+        }
+
+
+class HBaseMetrics(object):
+    """
+    HBaseClient 的指标收集器，包括：
+        - 每个 Thrift 方法的延迟直方图（包括扫描的每个分块、新建连接 connect）
+        - 每个方法的错误数和重试数
+        - 发送/接收的字节数
+        - 打开 scanner 的次数、新建连接的次数
+
+    可以通过 snapshot() 获取字典形式的快照，通过 render_prometheus() 输出 Prometheus 文本格式，
+    或者指定 callback，每记录一次请求就回调一次。
+    HBaseClient 不传入 metrics 时不会做任何统计。
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[str, float, bool], None] = None,
+        prefix: str = "hbase_client",
+    ):
+        """
+        :param callback: 每次请求完成后的回调，参数为 (方法名, 耗时秒数, 是否成功)
+        :param prefix: Prometheus 指标名前缀
+        """
+        self.callback = callback
+        self.prefix = prefix
+        self.histograms = {}
+        self.errors = {}
+        self.retries = {}
+        self.counters = {
+            "bytes_sent": 0,
+            "bytes_received": 0,
+            "scanner_opens": 0,
+            "connects": 0,
+        }
+        self._lock = threading.Lock()
+
+    def record(self, method: str, seconds: float, ok: bool = True):
+        """
+        记录一次请求
+
+        :param method:
+        :param seconds:
+        :param ok:
+        :return:
+        """
+        with self._lock:
+            histogram = self.histograms.get(method)
+            if histogram is None:
+                histogram = self.histograms[method] = Histogram()
+            histogram.record(seconds)
+            if not ok:
+                self.errors[method] = self.errors.get(method, 0) + 1
+        if self.callback is not None:
+            self.callback(method, seconds, ok)
+
+    def record_retry(self, method: str):
+        with self._lock:
+            self.retries[method] = self.retries.get(method, 0) + 1
+
+    def incr(self, name: str, value: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.errors = {}
+            self.retries = {}
+            self.counters = {k: 0 for k in self.counters}
+
+    def snapshot(self) -> dict:
+        """
+        获取当前所有指标的快照
+
+        :return:
+        """
+        with self._lock:
+            return {
+                "latency": {m: h.to_dict() for m, h in self.histograms.items()},
+                "errors": dict(self.errors),
+                "retries": dict(self.retries),
+                **self.counters,
+            }
+
+    def render_prometheus(self) -> str:
+        """
+        输出 Prometheus 文本格式，延迟以 summary 的形式给出分位数
+
+        :return:
+        """
+        snapshot = self.snapshot()
+        name = "{}_request_seconds".format(self.prefix)
+        lines = [
+            "# HELP {} Latency of HBase Thrift requests.".format(name),
+            "# TYPE {} summary".format(name),
+        ]
+        for method, stat in sorted(snapshot["latency"].items()):
+            for quantile, key in _QUANTILES:
+                lines.append(
+                    '{}{{method="{}",quantile="{}"}} {}'.format(
+                        name, method, quantile, stat[key]
+                    )
+                )
+            lines.append('{}_sum{{method="{}"}} {}'.format(name, method, stat["sum"]))
+            lines.append(
+                '{}_count{{method="{}"}} {}'.format(name, method, stat["count"])
+            )
+
+        for metric in ("errors", "retries"):
+            name = "{}_{}_total".format(self.prefix, metric)
+            lines.append("# TYPE {} counter".format(name))
+            for method, value in sorted(snapshot.pop(metric).items()):
+                lines.append('{}{{method="{}"}} {}'.format(name, method, value))
+
+        # 剩下的都是在 snapshot 中加锁复制出来的计数器，不直接遍历 self.counters
+        del snapshot["latency"]
+        for metric, value in sorted(snapshot.items()):
+            name = "{}_{}_total".format(self.prefix, metric)
+            lines.append("# TYPE {} counter".format(name))
+            lines.append("{} {}".format(name, value))
+        return "\n".join(lines) + "\n"
+
+
+class MeteredSocket(TSocket.TSocket):
+    """
+    统计收发字节数的 TSocket
+    """
+
+    def __init__(self, host: str, port: int, metrics: HBaseMetrics):
+        super().__init__(host, port)
+        self.metrics = metrics
+
+    def read(self, sz: int) -> bytes:
+        buff = super().read(sz)
+        self.metrics.incr("bytes_received", len(buff))
+        return buff
+
+    def write(self, buff: bytes):
+        super().write(buff)
+        self.metrics.incr("bytes_sent", len(buff))
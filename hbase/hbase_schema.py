@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Author : Sz
+@Project: rtg-tools
+@File   : hbase_schema.py
+@Time   : 2020/10/22 0022 14:18
+"""
+import json
+import struct
+from collections import namedtuple
+from typing import Dict, List, Union
+
+from hbase.hbase_client.ttypes import TColumnValue, TResult
+from hbase.hbase_tools import BINARY_TYPES, DOUBLE_CODEC, LONG_CODEC, make_column_value
+
+# 单元格的编解码函数，encode: value -> bytes，decode: bytes -> value
+Codec = namedtuple("Codec", ["encode", "decode"])
+
+
+def _fixed(fmt: str) -> Codec:
+    codec = struct.Struct(fmt)
+    unpack = codec.unpack
+
+    return Codec(codec.pack, lambda b: unpack(b)[0])
+
+
+def _encode_str(value) -> bytes:
+    return value.encode() if type(value) is str else str(value).encode()
+
+
+def _encode_bytes(value) -> bytes:
+    # bytes(5) 会得到 5 个 \x00，不能把任意值交给 bytes()
+    if type(value) not in BINARY_TYPES:
+        raise TypeError(
+            "bytes column expects bytes/bytearray/memoryview, got {}".format(
+                type(value).__name__
+            )
+        )
+    return bytes(value)
+
+
+def _encode_json(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+# 内置的编解码方式，二进制格式与 HBase Java 客户端的 Bytes.toBytes/Bytes.toXxx 兼容
+CODECS = {
+    "str": Codec(_encode_str, bytes.decode),
+    "bytes": Codec(_encode_bytes, bytes),
+    "long": Codec(LONG_CODEC.pack, lambda b: LONG_CODEC.unpack(b)[0]),
+    "int": _fixed(">i"),
+    "short": _fixed(">h"),
+    "double": Codec(DOUBLE_CODEC.pack, lambda b: DOUBLE_CODEC.unpack(b)[0]),
+    "float": _fixed(">f"),
+    "bool": Codec(lambda v: b"\xff" if v else b"\x00", lambda b: b != b"\x00"),
+    "json": Codec(_encode_json, json.loads),
+    # 以字符串形式保存的数字，兼容 str() 写入的旧数据
+    "str_int": Codec(_encode_str, int),
+    "str_float": Codec(_encode_str, float),
+}
+
+
+def get_codec(codec: Union[str, Codec]) -> Codec:
+    if isinstance(codec, Codec):
+        return codec
+    try:
+        return CODECS[codec]
+    except KeyError:
+        raise ValueError("unknown codec: {}".format(codec))
+
+
+class TableSchema(object):
+    """
+    声明式的表结构，指定每一列（或每个 column family）使用的编解码方式，
+    在初始化时预编译为按 bytes/str 名称索引的查找表，编解码时每个单元格只需要两次字典查找，
+    没有声明的列名在第一次出现时加入查找表，最多缓存 MAX_CACHED_COLUMNS 个，之后每次重新编码，
+    例如：
+        TableSchema(
+            {
+                "info:age": "long",
+                "info:score": "double",
+                "info:tags": "json",
+                "raw": "bytes",     # 整个 column family
+            },
+            default="str",
+        )
+    """
+
+    # 缓存的未声明列名的数量上限，避免动态列名无限占用内存
+    MAX_CACHED_COLUMNS = 100000
+
+    def __init__(
+        self,
+        columns: Dict[str, Union[str, Codec]],
+        default: Union[str, Codec] = "str",
+    ):
+        """
+        :param columns: {"<family>:<qualifier>": codec} 或 {"<family>": codec}，
+                codec 为 CODECS 中的名称或 Codec
+        :param default: 没有声明的列使用的编解码方式
+        """
+        self.columns = columns
+        self.default = get_codec(default)
+
+        # 编码:
+        # {family: (family bytes, family codec, {qualifier: (qualifier bytes, encode)})}
+        self._encoders = {}
+        # 解码:
+        # {family bytes: (family str, family decode,
+        #                {qualifier bytes: (qualifier str, decode)})}
+        self._decoders = {}
+        self._cached = 0
+        family_codecs = {
+            name: get_codec(codec) for name, codec in columns.items() if ":" not in name
+        }
+        for name, codec in columns.items():
+            family, _, qualifier = name.partition(":")
+            self._family(family, family_codecs.get(family, self.default))
+            if qualifier:
+                codec = get_codec(codec)
+                self._encoders[family][2][qualifier] = (
+                    qualifier.encode(),
+                    codec.encode,
+                )
+                self._decoders[family.encode()][2][qualifier.encode()] = (
+                    qualifier,
+                    codec.decode,
+                )
+
+    def _family(self, family: str, codec: Codec = None):
+        encoder = self._encoders.get(family)
+        if encoder is None:
+            codec = codec or self.default
+            family_bytes = family.encode()
+            encoder = self._encoders[family] = (family_bytes, codec, {})
+            self._decoders[family_bytes] = (family, codec.decode, {})
+        return encoder
+
+    def _family_decoder(self, family: bytes):
+        decoder = self._decoders.get(family)
+        if decoder is None:
+            self._family(family.decode())
+            decoder = self._decoders[family]
+        return decoder
+
+    def encode_row(self, row_value: dict) -> List[TColumnValue]:
+        """
+        按表结构将 Python dict 编码为 TColumnValue 列表，不会修改 row_value，
+        row_key 会被跳过，bytes/bytearray/memoryview 类型的值直接写入
+
+        :param row_value:
+        :return:
+        """
+        row_data = []
+        append = row_data.append
+        for column_family, column_data in row_value.items():
+            if column_family == "row_key":
+                continue
+            family, family_codec, qualifiers = self._family(column_family)
+            for k, v in column_data.items():
+                qualifier = qualifiers.get(k)
+                if qualifier is None:
+                    # 没有声明的列按 column family 的方式编码，并缓存编码后的列名
+                    qualifier = (k.encode(), family_codec.encode)
+                    if self._cached < self.MAX_CACHED_COLUMNS:
+                        qualifiers[k] = qualifier
+                        self._cached += 1
+                if type(v) not in BINARY_TYPES:
+                    v = qualifier[1](v)
+                append(make_column_value(family, qualifier[0], v))
+        return row_data
+
+    def decode_row(self, row_data: TResult, versioned: bool = False) -> dict:
+        """
+        按表结构将 TResult 解码为 Python dict，格式与 HBaseClient.decode_row_value 相同
+
+        :param row_data:
+        :param versioned: 是否保留多版本，见 HBaseClient.decode_row_value
+        :return:
+        """
+        row_value = {}
+        for column in row_data.columnValues:
+            family, family_decode, qualifiers = self._family_decoder(column.family)
+            qualifier = qualifiers.get(column.qualifier)
+            if qualifier is None:
+                qualifier = (column.qualifier.decode(), family_decode)
+                if self._cached < self.MAX_CACHED_COLUMNS:
+                    qualifiers[column.qualifier] = qualifier
+                    self._cached += 1
+            cells = row_value.get(family)
+            if cells is None:
+                cells = row_value[family] = {}
+            value = qualifier[1](column.value)
+            if versioned:
+                versions = cells.get(qualifier[0])
+                if versions is None:
+                    versions = cells[qualifier[0]] = []
+                versions.append((column.timestamp, value))
+            else:
+                cells[qualifier[0]] = value
+        return row_value
+
+    def decode_cell(self, family: bytes, qualifier: bytes, value: bytes):
+        """
+        解码单个单元格，供 RowView 按需解码使用
+
+        :param family:
+        :param qualifier:
+        :param value:
+        :return:
+        """
+        _, family_decode, qualifiers = self._family_decoder(family)
+        decoder = qualifiers.get(qualifier)
+        return (family_decode if decoder is None else decoder[1])(value)
+
+
+if __name__ == "__main__":
+    from hbase.hbase_tools import HBaseClient
+
+    user_schema = TableSchema(
+        {
+            "info:age": "long",
+            "info:score": "double",
+            "info:tags": "json",
+            "raw": "bytes",
+        }
+    )
+    with HBaseClient("localhost", 9090, schemas={"YOUR_TABLE_NAME": user_schema}) as hc:
+        hc.put_row(
+            "YOUR_TABLE_NAME",
+            "row_key_01",
+            {
+                "info": {"name": "sz", "age": 18, "score": 99.5, "tags": ["a", "b"]},
+                "raw": {"avatar": b"\x89PNG"},
+            },
+        )
+        print(hc.get_row("YOUR_TABLE_NAME", "row_key_01"))
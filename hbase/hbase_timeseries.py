@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Author : Sz
+@Project: rtg-tools
+@File   : hbase_timeseries.py
+@Time   : 2020/10/28 0028 16:40
+"""
+import struct
+import zlib
+from typing import Dict, Generator, Iterable, List, Tuple, Union
+
+from hbase.hbase_client.ttypes import TColumn, TPut, TScan
+from hbase.hbase_tools import (
+    DOUBLE_CODEC,
+    LONG_CODEC,
+    MAX_TIMESTAMP,
+    HBaseClient,
+    make_column_value,
+)
+
+# 单元格的列名，即数据点在所属时间桶内的毫秒偏移量
+OFFSET_CODEC = struct.Struct(">I")
+
+
+def _avg(values: List[float]) -> float:
+    return sum(values) / len(values)
+
+
+# 降采样的聚合函数
+AGGREGATORS = {
+    "avg": _avg,
+    "sum": sum,
+    "min": min,
+    "max": max,
+    "count": len,
+    "first": lambda values: values[0],
+    "last": lambda values: values[-1],
+}
+
+
+class TimeSeriesTable(object):
+    """
+    时间序列表，
+    每行保存一个实体（如指标名）在一个时间桶内的所有数据点，行键为定长二进制：
+        [盐值 1 字节] + 实体（定长，不足补 \\x00） + 时间桶起点（8 字节，reverse_time 时为 Long.MAX_VALUE - 起点）
+    列名为数据点在桶内的毫秒偏移量（4 字节），值为 8 字节 double，与 HBase Bytes.toBytes(double) 兼容。
+
+    同一实体的所有行是连续的，任意时间范围的查询都只需要一次扫描，
+    扫描结果直接从 TResult 解析，不经过字典解码，适合一次读取大量数据点。
+    """
+
+    def __init__(
+        self,
+        client: HBaseClient,
+        table: str,
+        family: str = "d",
+        bucket: int = 3600,
+        entity_width: int = 16,
+        reverse_time: bool = True,
+        salt_buckets: int = 0,
+    ):
+        """
+        :param client:
+        :param table:
+        :param family:
+        :param bucket: 每行覆盖的时间长度，秒，不能超过 49 天（列名为 4 字节的毫秒偏移量）
+        :param entity_width: 实体在行键中的字节数
+        :param reverse_time: 时间桶是否倒序排列，即新数据的行键更小
+        :param salt_buckets: 盐值桶数，大于 0 时在行键前加上由实体计算出的 1 字节盐值，
+                把不同实体的写入分散到多个 region，同一实体仍然连续；最多 256
+        """
+        if bucket * 1000 > 2 ** 32:
+            raise ValueError("bucket is too large: {}".format(bucket))
+        if salt_buckets > 256:
+            raise ValueError("at most 256 salt buckets are supported")
+        self.client = client
+        self.table = table
+        self.family = family.encode()
+        self.bucket_ms = bucket * 1000
+        self.entity_width = entity_width
+        self.reverse_time = reverse_time
+        self.salt_buckets = salt_buckets
+
+    def split_keys(self) -> List[bytes]:
+        """
+        盐值桶对应的分割点，可以用于 hbase_ddl.HBaseAdmin.create_table
+
+        :return:
+        """
+        return [bytes([salt]) for salt in range(1, self.salt_buckets)]
+
+    def entity_prefix(self, entity: str) -> bytes:
+        """
+        实体的行键前缀，即盐值 + 定长实体
+
+        :param entity:
+        :return:
+        """
+        encoded = entity.encode()
+        if len(encoded) > self.entity_width:
+            raise ValueError(
+                "entity is longer than {} bytes: {}".format(self.entity_width, entity)
+            )
+        prefix = encoded.ljust(self.entity_width, b"\x00")
+        if self.salt_buckets:
+            prefix = bytes([zlib.crc32(encoded) % self.salt_buckets]) + prefix
+        return prefix
+
+    def row_key(self, prefix: bytes, bucket_start: int) -> bytes:
+        """
+        :param prefix: entity_prefix 的结果
+        :param bucket_start: 时间桶起点，毫秒时间戳
+        :return:
+        """
+        if self.reverse_time:
+            bucket_start = MAX_TIMESTAMP - bucket_start
+        return prefix + LONG_CODEC.pack(bucket_start)
+
+    def bucket_start(self, row_key: bytes) -> int:
+        value = LONG_CODEC.unpack_from(row_key, len(row_key) - LONG_CODEC.size)[0]
+        return MAX_TIMESTAMP - value if self.reverse_time else value
+
+    def make_puts(
+        self, entity: str, points: Iterable[Tuple[int, float]]
+    ) -> List[TPut]:
+        """
+        将数据点按时间桶分组为 TPut，每个时间桶一个
+
+        :param entity:
+        :param points: [(<毫秒时间戳>, <值>), ...]
+        :return:
+        """
+        prefix = self.entity_prefix(entity)
+        bucket_ms = self.bucket_ms
+        family = self.family
+        pack_offset, pack_value = OFFSET_CODEC.pack, DOUBLE_CODEC.pack
+        rows = {}
+        for ts, value in points:
+            offset = ts % bucket_ms
+            columns = rows.get(ts - offset)
+            if columns is None:
+                columns = rows[ts - offset] = []
+            columns.append(
+                make_column_value(family, pack_offset(offset), pack_value(value))
+            )
+        return [
+            TPut(self.row_key(prefix, bucket_start), columns)
+            for bucket_start, columns in rows.items()
+        ]
+
+    def write(
+        self,
+        series: Dict[str, Iterable[Tuple[int, float]]],
+        batch_size: int = 1000,
+        durability: Union[int, str] = None,
+    ) -> int:
+        """
+        批量写入数据点，返回写入的数据点数，
+        每 batch_size 行通过一次 putMultiple 写入，重试后仍失败时抛出 IOError
+
+        :param series: {<实体>: [(<毫秒时间戳>, <值>), ...]}
+        :param batch_size: 每次 putMultiple 的行数（时间桶数）
+        :param durability: 同 HBaseClient.put_row
+        :return:
+        """
+        t_puts = [
+            t_put
+            for entity, points in series.items()
+            for t_put in self.make_puts(entity, points)
+        ]
+        for i in range(0, len(t_puts), batch_size):
+            batch = t_puts[i:i + batch_size]
+            if self.client.put_rows(self.table, batch, durability=durability) is None:
+                raise IOError(
+                    "failed to write {} rows into {}".format(len(batch), self.table)
+                )
+        return sum(len(t_put.columnValues) for t_put in t_puts)
+
+    def _scan(self, prefix: bytes, t0: int, t1: int, ascending: bool) -> TScan:
+        """
+        覆盖 [t0, t1) 所有时间桶的一次扫描，ascending 表示按时间先后返回
+        """
+        first = self.row_key(prefix, t0 - t0 % self.bucket_ms)
+        last_ts = t1 - 1
+        last = self.row_key(prefix, last_ts - last_ts % self.bucket_ms)
+        low, high = (last, first) if self.reverse_time else (first, last)
+        # 行键定长，low 减一、high 之后紧跟 \x00 分别是紧挨着的前一个、后一个行键
+        forward = ascending != self.reverse_time
+        if forward:
+            return TScan(
+                startRow=low, stopRow=high + b"\x00", columns=[TColumn(self.family)]
+            )
+        low_value = LONG_CODEC.unpack_from(low, len(low) - LONG_CODEC.size)[0]
+        if low_value > 0:
+            before_low = prefix + LONG_CODEC.pack(low_value - 1)
+        else:
+            before_low = prefix
+        return TScan(
+            startRow=high,
+            stopRow=before_low,
+            columns=[TColumn(self.family)],
+            reversed=True,
+        )
+
+    def points(
+        self,
+        entity: str,
+        t0: int,
+        t1: int,
+        ascending: bool = True,
+        chunk: int = 100,
+        max_bytes: int = None,
+    ) -> Generator:
+        """
+        以生成器形式返回 [t0, t1) 之间的原始数据点 (<毫秒时间戳>, <值>)
+
+        :param entity:
+        :param t0: 起始毫秒时间戳，包含
+        :param t1: 结束毫秒时间戳，不包含
+        :param ascending: 是否按时间先后返回
+        :param chunk: 每次请求的行数
+        :param max_bytes: 同 HBaseClient.scan_results
+        :return:
+        """
+        if t1 <= t0:
+            return
+        prefix = self.entity_prefix(entity)
+        t_scan = self._scan(prefix, t0, t1, ascending)
+        unpack_offset, unpack_value = OFFSET_CODEC.unpack, DOUBLE_CODEC.unpack
+        for row_data in self.client.scan_results(self.table, t_scan, chunk, max_bytes):
+            bucket_start = self.bucket_start(row_data.row)
+            columns = (
+                row_data.columnValues if ascending else reversed(row_data.columnValues)
+            )
+            for column in columns:
+                ts = bucket_start + unpack_offset(column.qualifier)[0]
+                if t0 <= ts < t1:
+                    yield ts, unpack_value(column.value)[0]
+
+    def range(
+        self,
+        entity: str,
+        t0: int,
+        t1: int,
+        interval: int = None,
+        agg: str = "avg",
+        ascending: bool = True,
+        chunk: int = 100,
+        max_bytes: int = None,
+    ) -> Generator:
+        """
+        查询实体在 [t0, t1) 之间的数据，只需要一次扫描，
+        指定 interval 时在客户端按 interval 毫秒对齐的窗口降采样，
+        每个窗口返回一个 (<窗口起点>, <聚合值>)，只需要在内存中保留一个窗口的数据
+
+        :param entity:
+        :param t0: 起始毫秒时间戳，包含
+        :param t1: 结束毫秒时间戳，不包含
+        :param interval: 降采样窗口，毫秒，为空时返回原始数据点
+        :param agg: 聚合方式，AGGREGATORS 中的名称或 list -> value 的函数
+        :param ascending: 是否按时间先后返回
+        :param chunk: 每次请求的行数
+        :param max_bytes: 同 HBaseClient.scan_results
+        :return:
+        """
+        points = self.points(entity, t0, t1, ascending, chunk, max_bytes)
+        if not interval:
+            yield from points
+            return
+
+        aggregate = AGGREGATORS[agg] if isinstance(agg, str) else agg
+        window, values = None, []
+        for ts, value in points:
+            start = ts - ts % interval
+            if start != window:
+                if values:
+                    yield window, aggregate(values)
+                window, values = start, []
+            values.append(value)
+        if values:
+            yield window, aggregate(values)
+
+
+if __name__ == "__main__":
+    import time
+
+    from hbase.hbase_ddl import HBaseAdmin
+
+    with HBaseClient("localhost", 9090) as hc:
+        metrics = TimeSeriesTable(hc, "YOUR_METRIC_TABLE", bucket=3600, salt_buckets=16)
+        HBaseAdmin(hc).create_table(
+            "YOUR_METRIC_TABLE", ["d"], split_keys=metrics.split_keys(), exist_ok=True
+        )
+
+        now = int(time.time() * 1000)
+        metrics.write(
+            {
+                "cpu.host01": [(now - i * 1000, i % 100) for i in range(86400)],
+                "cpu.host02": [(now - i * 1000, i % 50) for i in range(86400)],
+            }
+        )
+
+        # raw points of the last 10 minutes
+        for ts, value in metrics.range("cpu.host01", now - 600 * 1000, now + 1):
+            print(ts, value)
+
+        # 5 minute max over the last day
+        for ts, value in metrics.range(
+            "cpu.host01", now - 86400 * 1000, now + 1, interval=300 * 1000, agg="max"
+        ):
+            print(ts, value)
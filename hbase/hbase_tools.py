@@ -6,14 +6,27 @@
 @File   : hbase_tools.py
 @Time   : 2018/3/2 0002 10:47
 """
+import itertools
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import struct
+import threading
 import time
-from functools import wraps
-from typing import Union, List, Dict, Generator
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial, wraps
+from typing import Union, List, Dict, Generator, Tuple, Optional, TYPE_CHECKING
 
 from thrift.protocol import TBinaryProtocol
 from thrift.transport import TSocket
+from thrift.transport.TTransport import TTransportException
 
 from hbase.hbase_client import THBaseService
+from hbase.hbase_metrics import HBaseMetrics, Histogram, MeteredSocket
 from hbase.hbase_client.ttypes import (
     TTransport,
     TColumnValue,
@@ -22,8 +35,607 @@ from hbase.hbase_client.ttypes import (
     TDelete,
     TScan,
     TResult,
+    TTimeRange,
+    TDurability,
+    TTableName,
 )
 
+if TYPE_CHECKING:
+    from hbase.hbase_schema import TableSchema
+
+# HBase Bytes.toBytes(long)/Bytes.toBytes(double) 兼容的大端编码
+LONG_CODEC = struct.Struct(">q")
+DOUBLE_CODEC = struct.Struct(">d")
+
+# HBase 时间戳的上限，即 Java 中的 Long.MAX_VALUE
+MAX_TIMESTAMP = 2 ** 63 - 1
+
+# 无需转换即可直接写入的值类型
+BINARY_TYPES = (bytes, bytearray, memoryview)
+
+# family/qualifier 名称的编码缓存，限制大小以免动态列名无限占用内存
+_NAME_CACHE = {}
+_NAME_CACHE_SIZE = 100000
+
+
+def _encode_name(name: str) -> bytes:
+    encoded = name.encode()
+    if len(_NAME_CACHE) < _NAME_CACHE_SIZE:
+        _NAME_CACHE[name] = encoded
+    return encoded
+
+
+def encode_value(value, typed: bool = False) -> Union[bytes, bytearray, memoryview]:
+    """
+    将单个值编码为 HBase 单元格的内容，
+    typed 为 True 时 int 编码为 8 字节大端 long，float 编码为 8 字节大端 double，
+    bool 编码为 1 字节（与 HBase Bytes.toBytes(boolean) 一致）
+
+    :param value:
+    :param typed:
+    :return:
+    """
+    value_type = type(value)
+    if value_type is str:
+        return value.encode()
+    if value_type in BINARY_TYPES:
+        return value
+    if typed:
+        if value_type is bool:
+            return b"\xff" if value else b"\x00"
+        if value_type is int:
+            return LONG_CODEC.pack(value)
+        if value_type is float:
+            return DOUBLE_CODEC.pack(value)
+    return str(value).encode()
+
+
+class _TColumnValue(TColumnValue):
+    """
+    只设置 family/qualifier/value 的 TColumnValue，仅供本模块内部使用，
+    其他模块请通过 make_column_value 构造；
+    跳过生成代码里逐个字段赋值的 __init__，其余字段使用类属性上的默认值 None；
+    生成代码的 __eq__/__repr__ 基于实例的 __dict__，这里按 thrift_spec 中的全部字段重新实现，
+    与 TColumnValue 互相比较时结果与普通的 TColumnValue 一致
+    """
+
+    timestamp = tags = type = None
+    __init__ = object.__init__
+
+    _FIELDS = tuple(spec[2] for spec in TColumnValue.thrift_spec if spec)
+
+    def __eq__(self, other):
+        return isinstance(other, TColumnValue) and all(
+            getattr(self, name) == getattr(other, name) for name in self._FIELDS
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "TColumnValue({})".format(
+            ", ".join(
+                "{}={!r}".format(name, getattr(self, name)) for name in self._FIELDS
+            )
+        )
+
+
+def make_column_value(
+    family: bytes, qualifier: bytes, value: Union[bytes, bytearray, memoryview]
+) -> TColumnValue:
+    """
+    构造只包含 family/qualifier/value 的 TColumnValue，
+    比直接调用 TColumnValue(family=..., qualifier=..., value=...) 快，
+    结果可以与 TColumnValue 互相比较
+
+    :param family:
+    :param qualifier:
+    :param value: 已经编码好的值
+    :return:
+    """
+    column = _TColumnValue()
+    column.family = family
+    column.qualifier = qualifier
+    column.value = value
+    return column
+
+
+def _decode_cell(family: bytes, qualifier: bytes, value: bytes):
+    return value.decode()
+
+
+class FamilyView(object):
+    """
+    RowView 中的一个 column family，按需查找并解码单元格，
+    行为与 {<qualifier>: <cell>} 的只读字典一致
+    """
+
+    __slots__ = ("_row", "_family")
+
+    def __init__(self, row: "RowView", family: bytes):
+        self._row = row
+        self._family = family
+
+    def _columns(self, qualifier: bytes = None) -> Generator:
+        family = self._family
+        for column in self._row._result.columnValues:
+            if column.family == family and (
+                qualifier is None or column.qualifier == qualifier
+            ):
+                yield column
+
+    def _decode(self, column: TColumnValue):
+        return self._row._decode(column.family, column.qualifier, column.value)
+
+    def __getitem__(self, qualifier: str):
+        qualifier = _NAME_CACHE.get(qualifier) or _encode_name(qualifier)
+        if not self._row._versioned:
+            for column in self._columns(qualifier):
+                return self._decode(column)
+            raise KeyError(qualifier.decode())
+        cells = [
+            (column.timestamp, self._decode(column))
+            for column in self._columns(qualifier)
+        ]
+        if not cells:
+            raise KeyError(qualifier.decode())
+        return cells
+
+    def get(self, qualifier: str, default=None):
+        try:
+            return self[qualifier]
+        except KeyError:
+            return default
+
+    def __contains__(self, qualifier: str) -> bool:
+        qualifier = _NAME_CACHE.get(qualifier) or _encode_name(qualifier)
+        return any(True for _ in self._columns(qualifier))
+
+    def __iter__(self):
+        seen = None
+        for column in self._columns():
+            # 同一单元格的多个版本是连续的
+            if column.qualifier != seen:
+                seen = column.qualifier
+                yield seen.decode()
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(qualifier, self[qualifier]) for qualifier in self]
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class RowView(object):
+    """
+    TResult 的惰性只读视图，访问 row[<cf>][<qualifier>] 时才查找并解码对应的单元格，
+    不会为整行构造嵌套字典，适合只读取少数几列的过滤类扫描；
+    row["row_key"]、迭代、keys()/items() 的行为与 decode_row_value 生成的字典一致，
+    需要完整数据时用 to_dict() 转换。
+    查找单元格需要遍历整行，频繁访问很宽的行时先 to_dict() 更快。
+    """
+
+    __slots__ = ("_result", "_decode", "_versioned")
+
+    def __init__(self, result: TResult, decode=None, versioned: bool = False):
+        """
+        :param result:
+        :param decode: 单元格的解码函数 (family, qualifier, value) -> value，默认按 utf-8 解码
+        :param versioned: 同 decode_row_value
+        """
+        self._result = result
+        self._decode = decode or _decode_cell
+        self._versioned = versioned
+
+    @property
+    def row_key(self) -> str:
+        return self._result.row.decode()
+
+    @property
+    def partial(self) -> bool:
+        """
+        是否为被拆分的部分行，见 scan_row 的 allow_partial
+        """
+        return bool(self._result.partial)
+
+    @property
+    def result(self) -> TResult:
+        return self._result
+
+    def __getitem__(self, family: str):
+        if family == "row_key":
+            return self.row_key
+        family_bytes = _NAME_CACHE.get(family) or _encode_name(family)
+        for column in self._result.columnValues:
+            if column.family == family_bytes:
+                return FamilyView(self, family_bytes)
+        raise KeyError(family)
+
+    def get(self, family: str, default=None):
+        try:
+            return self[family]
+        except KeyError:
+            return default
+
+    def __contains__(self, family: str) -> bool:
+        return family in self.keys()
+
+    def __iter__(self):
+        yield "row_key"
+        seen = set()
+        for column in self._result.columnValues:
+            if column.family not in seen:
+                seen.add(column.family)
+                yield column.family.decode()
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(family, self[family]) for family in self]
+
+    def to_dict(self) -> dict:
+        row_value = {"row_key": self.row_key}
+        decode = self._decode
+        versioned = self._versioned
+        for column in self._result.columnValues:
+            cells = row_value.setdefault(column.family.decode(), {})
+            value = decode(column.family, column.qualifier, column.value)
+            if versioned:
+                cells.setdefault(column.qualifier.decode(), []).append(
+                    (column.timestamp, value)
+                )
+            else:
+                cells[column.qualifier.decode()] = value
+        if self._result.partial:
+            row_value["partial"] = True
+        return row_value
+
+    def __repr__(self):
+        return "RowView({!r})".format(self.to_dict())
+
+
+# 说明网关本身（而不是请求）出了问题的异常，出现时会关闭连接并记录网关失败
+GATEWAY_ERRORS = (TTransportException, OSError, EOFError)
+
+
+class StaleConnectionError(TTransportException):
+    """
+    从连接池中取出的连接在第一次请求时就失败了，通常是连接空闲期间被网关关闭（空闲超时、网关重启），
+    不说明网关不可用，调用方可以在新建的连接上重试一次
+    """
+
+
+def parse_gateways(
+    hbase_host: Union[str, List[Union[str, Tuple[str, int]]]], hbase_port: int
+) -> List[Tuple[str, int]]:
+    """
+    解析网关地址，支持以下形式：
+        - "host"，端口使用 hbase_port
+        - "host1:port1,host2:port2"
+        - ["host1:port1", ("host2", port2), "host3"]
+
+    :param hbase_host:
+    :param hbase_port: 没有指定端口时使用的默认端口
+    :return: [(host, port), ...]
+    """
+    if isinstance(hbase_host, str):
+        hbase_host = hbase_host.split(",")
+    gateways = []
+    for gateway in hbase_host:
+        if isinstance(gateway, str):
+            host, _, port = gateway.strip().partition(":")
+            gateways.append((host, int(port) if port else hbase_port))
+        else:
+            gateways.append((gateway[0], int(gateway[1])))
+    return gateways
+
+
+def read_checkpoint(checkpoint: str) -> Optional[int]:
+    """
+    读取检查点文件中记录的整数，文件不存在或为空时返回 None
+
+    :param checkpoint:
+    :return:
+    """
+    if not checkpoint or not os.path.exists(checkpoint):
+        return None
+    with open(checkpoint, "r") as f:
+        content = f.read().strip()
+    return int(content) if content else None
+
+
+def write_checkpoint(checkpoint: str, value: int):
+    """
+    原子地写入检查点，先写临时文件再替换，避免崩溃时留下残缺的检查点
+
+    :param checkpoint:
+    :param value:
+    :return:
+    """
+    tmp_file = "{}.tmp".format(checkpoint)
+    with open(tmp_file, "w") as f:
+        f.write(str(value))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, checkpoint)
+
+
+def set_socket_options(
+    sock: socket.socket, keepalive: Union[bool, int] = None, nodelay: bool = False
+):
+    """
+    设置 TCP keepalive 和 TCP_NODELAY
+
+    :param sock:
+    :param keepalive: True 表示开启并使用系统默认参数，整数表示空闲多少秒后开始发送探测包
+    :param nodelay: 是否关闭 Nagle 算法
+    :return:
+    """
+    if nodelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if not keepalive:
+        return
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if keepalive is True:
+        return
+    # 以下选项不是所有平台都支持，不支持时使用系统默认值
+    for name, value in (
+        ("TCP_KEEPIDLE", keepalive),
+        ("TCP_KEEPINTVL", max(1, keepalive // 3)),
+        ("TCP_KEEPCNT", 3),
+    ):
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+
+class Connection(object):
+    """
+    到某个 Thrift 网关的单个连接，同一时间只能被一个线程使用
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: Union[int, float] = None,
+        metrics: HBaseMetrics = None,
+        keepalive: Union[bool, int] = None,
+        nodelay: bool = False,
+    ):
+        """
+        :param host:
+        :param port:
+        :param timeout: socket 超时时间，秒，默认不超时
+        :param metrics: 指定时统计收发的字节数
+        :param keepalive: 见 set_socket_options
+        :param nodelay: 见 set_socket_options
+        """
+        if metrics is None:
+            t_socket = TSocket.TSocket(host, port)
+        else:
+            t_socket = MeteredSocket(host, port, metrics)
+        if timeout:
+            t_socket.setTimeout(timeout * 1000)
+        transport = TTransport.TBufferedTransport(t_socket)
+        protocol = TBinaryProtocol.TBinaryProtocol(transport)
+        transport.open()
+        if keepalive or nodelay:
+            set_socket_options(t_socket.handle, keepalive, nodelay)
+        self.transport = transport
+        self.client = THBaseService.Client(protocol)
+        self.last_used = time.time()
+        # 是否是从连接池中取出的连接，在其上完成第一次请求之前不能确定连接仍然可用
+        self.reused = False
+
+    def close(self):
+        self.transport.close()
+
+    def is_open(self) -> bool:
+        return self.transport.isOpen()
+
+
+class Gateway(object):
+    """
+    一个 Thrift 网关，维护空闲连接池、进行中的请求数、延迟和失败统计，
+    连续失败 max_fails 次后会被摘除一段时间
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        timeout: Union[int, float] = None,
+        max_fails: int = 3,
+        eject_time: Union[int, float] = 30,
+        metrics: HBaseMetrics = None,
+        keepalive: Union[bool, int] = None,
+        nodelay: bool = False,
+        max_idle: Union[int, float] = 50,
+    ):
+        """
+        :param host:
+        :param port:
+        :param timeout: 连接的 socket 超时时间，秒
+        :param max_fails: 连续失败多少次后摘除
+        :param eject_time: 摘除的时长，秒，到期后重新参与负载均衡
+        :param metrics: 指定时统计建立连接的次数和耗时
+        :param keepalive: 见 set_socket_options
+        :param nodelay: 见 set_socket_options
+        :param max_idle: 空闲超过多少秒的连接不再使用，取出时直接重建，为空时不限制
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_fails = max_fails
+        self.eject_time = eject_time
+        self.metrics = metrics
+        self.keepalive = keepalive
+        self.nodelay = nodelay
+        self.max_idle = max_idle
+
+        self.idle = []
+        self.outstanding = 0
+        # 请求延迟的指数加权平均值，秒
+        self.latency = None
+        self.fails = 0
+        self.ejected_until = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "Gateway({}:{})".format(self.host, self.port)
+
+    @property
+    def available(self) -> bool:
+        return self.ejected_until <= time.time()
+
+    def connect(self) -> Connection:
+        if self.metrics is None:
+            return Connection(
+                self.host,
+                self.port,
+                self.timeout,
+                keepalive=self.keepalive,
+                nodelay=self.nodelay,
+            )
+        begin = time.perf_counter()
+        ok = False
+        try:
+            connection = Connection(
+                self.host,
+                self.port,
+                self.timeout,
+                self.metrics,
+                self.keepalive,
+                self.nodelay,
+            )
+            ok = True
+            return connection
+        finally:
+            self.metrics.incr("connects")
+            self.metrics.record("connect", time.perf_counter() - begin, ok)
+
+    def acquire(self, fresh: bool = False) -> Connection:
+        """
+        取出一个空闲连接，没有空闲连接时新建一个
+
+        :param fresh: 是否不使用空闲连接，直接新建
+        :return:
+        """
+        stale = ()
+        connection = None
+        with self.lock:
+            self.outstanding += 1
+            # 连接按归还的先后顺序排列，最近归还的连接都已空闲太久时，其余的连接也一样
+            if (
+                self.max_idle
+                and self.idle
+                and time.time() - self.idle[-1].last_used > self.max_idle
+            ):
+                stale, self.idle = self.idle, []
+            if self.idle and not fresh:
+                connection = self.idle.pop()
+                connection.reused = True
+        # 空闲太久的连接可能已经被网关关闭，直接重建，避免请求失败后才发现
+        for idle_connection in stale:
+            idle_connection.close()
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                with self.lock:
+                    self.outstanding -= 1
+                raise
+        return connection
+
+    def release(self, connection: Connection, broken: bool = False):
+        """
+        归还连接，已损坏的连接直接关闭
+
+        :param connection:
+        :param broken:
+        :return:
+        """
+        connection.last_used = time.time()
+        with self.lock:
+            self.outstanding -= 1
+            if not broken:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def mark_success(self, elapsed: float = None):
+        with self.lock:
+            self.fails = 0
+            if elapsed is not None:
+                self.latency = (
+                    elapsed
+                    if self.latency is None
+                    else self.latency * 0.8 + elapsed * 0.2
+                )
+
+    def mark_failure(self):
+        """
+        记录一次失败，连续失败达到上限后摘除该网关并关闭所有空闲连接
+
+        :return:
+        """
+        with self.lock:
+            self.fails += 1
+            if self.fails < self.max_fails:
+                return
+            self.ejected_until = time.time() + self.eject_time
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+    def restore(self, connection: Connection = None):
+        """
+        健康检查通过后恢复该网关
+
+        :param connection: 健康检查时建立的连接，放入连接池复用
+        :return:
+        """
+        with self.lock:
+            self.fails = 0
+            self.ejected_until = 0
+            if connection is not None:
+                self.idle.append(connection)
+
+    def warmup(self, connections: int):
+        """
+        预先建立连接，使空闲连接数达到 connections，避免请求时才建立连接带来的延迟
+
+        :param connections:
+        :return:
+        """
+        with self.lock:
+            missing = connections - len(self.idle)
+        for _ in range(missing):
+            self.restore(self.connect())
+
+    def discard_idle(self):
+        """
+        关闭所有空闲连接，某个空闲连接已失效时，同一时期归还的其他连接多半也已失效
+
+        :return:
+        """
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+    def close(self):
+        self.discard_idle()
+
 
 def retry(
     max_retry: int = 5,
@@ -31,6 +643,7 @@ def retry(
     sleep=time.sleep,
     ignore_exception: bool = False,
     verify: callable = None,
+    on_retry: callable = None,
 ):
     """
     重试装饰器
@@ -39,14 +652,18 @@ def retry(
     :param sleep: 重试等待方式，默认使用 time.sleep
     :param ignore_exception: 出现异常是否忽略，默认否
     :param verify: 验证结果函数，未通过则继续重试，默认为空
+    :param on_retry: 每次重试前的回调，参数为被装饰的函数及其调用参数，默认为空
     :return:
     """
 
     def wrapper(func):
         @wraps(func)
         def _wrapper(*args, **kwargs):
-            nonlocal delay, max_retry
-            while max_retry > 0:
+            # 每次调用单独计数，不能修改闭包中的 max_retry，否则所有调用共享同一个次数
+            remaining = max_retry
+            while remaining > 0:
+                if on_retry and remaining < max_retry:
+                    on_retry(func, *args, **kwargs)
                 try:
                     result = func(*args, **kwargs)
                     if verify and not verify(result):
@@ -64,13 +681,64 @@ def retry(
                     else:
                         raise
                 finally:
-                    max_retry -= 1
+                    remaining -= 1
 
         return _wrapper
 
     return wrapper
 
 
+def _count_retry(func, client, *args, **kwargs):
+    """
+    retry 的 on_retry 回调，记录 HBaseClient 方法的重试次数
+    """
+    if client.metrics is not None:
+        client.metrics.record_retry(func.__name__)
+
+
+def _scan_worker(
+    gateways: List[Tuple[str, int]],
+    options: dict,
+    table: str,
+    tasks,
+    results,
+    func,
+    reducer,
+    batch_size: int,
+    scan_kwargs: dict,
+):
+    """
+    scan_map/scan_reduce 的工作进程，使用自己的连接依次扫描 tasks 中的 (start, end) 分片，
+    func 的结果按 batch_size 分批放入 results，或者用 reducer 在进程内聚合，
+    结束时放入 ("done", (是否有聚合值, 聚合值))，出错时放入 ("error", 异常栈)
+    """
+    try:
+        with HBaseClient(gateways, health_check_interval=0, **options) as hc:
+            batch = []
+            has_value, acc = False, None
+            while True:
+                task = tasks.get()
+                if task is None:
+                    break
+                for row in hc.scan_row(table, task[0], task[1], **scan_kwargs):
+                    value = func(row)
+                    if value is None:
+                        continue
+                    if reducer is not None:
+                        acc = reducer(acc, value) if has_value else value
+                        has_value = True
+                        continue
+                    batch.append(value)
+                    if len(batch) >= batch_size:
+                        results.put(("batch", batch))
+                        batch = []
+            if batch:
+                results.put(("batch", batch))
+            results.put(("done", (has_value, acc)))
+    except BaseException:
+        results.put(("error", traceback.format_exc()))
+
+
 class HBaseClient(object):
     """
     基于 Thrift2 的 HBase 工具包，
@@ -78,20 +746,142 @@ class HBaseClient(object):
     没有 DDL 相关操作（数据表、字段增删等）。
     """
 
-    def __init__(self, hbase_host: str, hbase_port: int):
+    # 负载均衡策略
+    ROUND_ROBIN = "round_robin"
+    LEAST_OUTSTANDING = "least_outstanding"
+    LATENCY = "latency"
+
+    # get_many 并发请求使用的最大线程数
+    FANOUT_WORKERS = 8
+    # 对冲读取使用的最大线程数，每个读请求至少占用一个线程
+    HEDGE_WORKERS = 32
+    # 对冲读取的延迟样本少于该数量时使用 hedge_delay
+    HEDGE_MIN_SAMPLES = 100
+    # 对冲读取预算的上限，即短时间内最多可以连续对冲多少次
+    HEDGE_BURST = 10
+
+    def __init__(
+        self,
+        hbase_host: Union[str, List[Union[str, Tuple[str, int]]]],
+        hbase_port: int = 9090,
+        durability: Union[int, str] = None,
+        table_durability: Dict[str, Union[int, str]] = None,
+        balance: str = ROUND_ROBIN,
+        timeout: Union[int, float] = None,
+        max_fails: int = 3,
+        eject_time: Union[int, float] = 30,
+        health_check_interval: Union[int, float] = 5,
+        metrics: HBaseMetrics = None,
+        schemas: Dict[str, "TableSchema"] = None,
+        keepalive: Union[bool, int] = None,
+        nodelay: bool = False,
+        max_idle: Union[int, float] = 50,
+        warmup: int = 1,
+        probe_table: str = "hbase:meta",
+        hedge_percentile: float = None,
+        hedge_delay: Union[int, float] = 0.05,
+        hedge_ratio: float = 0.05,
+    ):
         """
-        初始化连接
+        初始化连接，
+        可以指定多个 Thrift 网关，请求会按 balance 策略分散到各个网关上，
+        连续失败的网关会被摘除，由后台线程定期检查，恢复后重新加入。
+        各个方法都是线程安全的，每个请求从对应网关的连接池中取一个连接使用。
 
-        :param hbase_host:
-        :param hbase_port:
+        :param hbase_host: 网关地址，可以是单个 host，也可以是多个网关，见 parse_gateways
+        :param hbase_port: 没有指定端口的网关使用的端口
+        :param durability: 写入时默认使用的 TDurability，为空则使用服务端（column family）的设置，
+                可以是 TDurability 的值或名称，如 TDurability.SKIP_WAL 或 "SKIP_WAL";
+        :param table_durability: 按表覆盖默认的 durability，{<table>: <durability>}
+        :param balance: 负载均衡策略:
+                    'round_robin' - 轮询,
+                    'least_outstanding' - 选择进行中请求最少的网关,
+                    'latency' - 按平均延迟的倒数加权随机选择;
+        :param timeout: socket 超时时间，秒，默认不超时
+        :param max_fails: 网关连续失败多少次后被摘除
+        :param eject_time: 网关被摘除的时长，秒
+        :param health_check_interval: 检查被摘除网关的间隔，秒，0 表示不做主动检查
+        :param metrics: 指标收集器，为空时不做任何统计
+        :param schemas: 按表指定的 hbase_schema.TableSchema，{<table>: <schema>}，
+                见 register_schema
+        :param keepalive: 开启 TCP keepalive，True 使用系统默认参数，整数表示空闲多少秒后开始探测
+        :param nodelay: 是否设置 TCP_NODELAY
+        :param max_idle: 连接空闲超过多少秒后在下次使用时重建，为空时不限制，
+                应小于网关关闭空闲连接的时间（hbase.thrift.server.socket.read.timeout，默认 60 秒）；
+                即使不限制，池中的连接第一次请求就失败时也会丢弃该网关所有的空闲连接，并在新连接上重试一次
+        :param warmup: 初始化时每个网关预先建立的连接数
+        :param probe_table: ping 和健康检查时通过 tableExists 探测的表，<namespace>:<table>
+        :param hedge_percentile: 开启对冲读取，get_row/get_rows/is_row_exist 超过该分位数的延迟还没有返回时，
+                向另一个网关发送相同的请求，使用先返回的结果，如 95；为空时不开启
+        :param hedge_delay: 延迟样本不足时使用的对冲等待时间，秒
+        :param hedge_ratio: 对冲请求占读请求的比例上限，限制额外增加的负载
         """
-        transport = TTransport.TBufferedTransport(
-            TSocket.TSocket(hbase_host, hbase_port)
+        if balance not in (self.ROUND_ROBIN, self.LEAST_OUTSTANDING, self.LATENCY):
+            raise ValueError("unsupported balance strategy: {}".format(balance))
+        self.balance = balance
+        self.metrics = metrics
+        self.gateways = [
+            Gateway(
+                host,
+                port,
+                timeout,
+                max_fails,
+                eject_time,
+                metrics,
+                keepalive,
+                nodelay,
+                max_idle,
+            )
+            for host, port in parse_gateways(hbase_host, hbase_port)
+        ]
+        ns, _, qualifier = probe_table.rpartition(":")
+        self.probe_table = TTableName(
+            ns=ns.encode() or None, qualifier=qualifier.encode()
         )
-        protocol = TBinaryProtocol.TBinaryProtocol(transport)
-        transport.open()
-        self.transport = transport
-        self.client = THBaseService.Client(protocol)
+        self._round_robin = itertools.count()
+        self._pinned = None
+        self._executor = None
+        self._hedge_executor = None
+        self._executor_lock = threading.Lock()
+
+        self.hedge_percentile = hedge_percentile
+        self.hedge_delay = hedge_delay
+        self.hedge_ratio = hedge_ratio
+        self._hedge_lock = threading.Lock()
+        # {method: [延迟直方图, 缓存的对冲等待时间, 距离下次重新计算的请求数]}
+        self._hedge_latency = {}
+        self._hedge_tokens = float(self.HEDGE_BURST)
+
+        # 与之前一样在初始化时建立连接，所有网关都无法连接时直接抛出异常
+        error = None
+        for gateway in self.gateways:
+            try:
+                gateway.restore(gateway.connect())
+            except GATEWAY_ERRORS as e:
+                error = e
+                gateway.ejected_until = time.time() + eject_time
+        if all(not gateway.available for gateway in self.gateways):
+            raise error
+        if warmup > 1:
+            self.warmup(warmup)
+
+        self.durability = self.parse_durability(durability)
+        self.table_durability = {
+            table: self.parse_durability(d)
+            for table, d in (table_durability or {}).items()
+        }
+        self.schemas = dict(schemas or {})
+
+        self._closed = threading.Event()
+        self._health_checker = None
+        if health_check_interval and len(self.gateways) > 1:
+            self._health_checker = threading.Thread(
+                target=self._health_check,
+                args=(health_check_interval,),
+                name="hbase-health-check",
+                daemon=True,
+            )
+            self._health_checker.start()
 
     def __enter__(self):
         return self
@@ -100,22 +890,338 @@ class HBaseClient(object):
         self.close()
 
     def close(self):
-        self.transport.close()
+        self._closed.set()
+        if self._pinned is not None:
+            self._pinned[1].close()
+            self._pinned = None
+        for executor in (self._executor, self._hedge_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        for gateway in self.gateways:
+            gateway.close()
+
+    @property
+    def transport(self):
+        """
+        兼容旧版本，固定使用的一个连接的 transport，非线程安全
+        """
+        return self._pin().transport
+
+    @property
+    def client(self) -> THBaseService.Client:
+        """
+        兼容旧版本，固定使用的一个连接的 THBaseService.Client，非线程安全，
+        不参与负载均衡和故障摘除，新代码请使用 HBaseClient 的方法
+        """
+        return self._pin().client
+
+    def _pin(self) -> Connection:
+        if self._pinned is None or not self._pinned[1].is_open():
+            if self._pinned is not None:
+                self._pinned[1].close()
+            gateway = self._pick_gateway()
+            connection = gateway.acquire()
+            # 固定使用的连接不归还，也不计入进行中的请求数，否则会一直影响 least_outstanding 的选择
+            with gateway.lock:
+                gateway.outstanding -= 1
+            self._pinned = (gateway, connection)
+        return self._pinned[1]
 
     def ping(self) -> bool:
         """
-        判断连接是否存活
+        判断连接是否存活，即能否通过某个网关完成一次 tableExists(probe_table) 请求，
+        探测请求很轻，不会读取任何数据
 
         :return:
         """
-        return self.transport.isOpen()
+        try:
+            self._call("tableExists", self.probe_table)
+        except Exception:
+            return False
+        return True
+
+    def warmup(self, connections: int):
+        """
+        为每个可用的网关预先建立连接，使空闲连接数达到 connections，
+        无法连接的网关会记录一次失败
+
+        :param connections: 每个网关的连接数
+        :return:
+        """
+        for gateway in self.gateways:
+            if not gateway.available:
+                continue
+            try:
+                gateway.warmup(connections)
+            except GATEWAY_ERRORS:
+                gateway.mark_failure()
+
+    def _health_check(self, interval: Union[int, float]):
+        """
+        后台线程，定期尝试连接被摘除的网关，成功则恢复
+
+        :param interval:
+        :return:
+        """
+        while not self._closed.wait(interval):
+            for gateway in self.gateways:
+                if gateway.available:
+                    continue
+                connection = None
+                try:
+                    connection = gateway.connect()
+                    # 能建立连接不代表网关可以正常处理请求
+                    connection.client.tableExists(self.probe_table)
+                except Exception:
+                    if connection is not None:
+                        connection.close()
+                    gateway.ejected_until = time.time() + gateway.eject_time
+                    continue
+                gateway.restore(connection)
+
+    def _pick_gateway(self, exclude: Tuple[Gateway, ...] = ()) -> Gateway:
+        """
+        按负载均衡策略选择一个网关，
+        所有网关都被摘除时选择最早恢复的那个，而不是直接失败
+
+        :param exclude: 不参与选择的网关
+        :return:
+        """
+        candidates = [
+            g for g in self.gateways if g.available and g not in exclude
+        ] or [g for g in self.gateways if g not in exclude] or self.gateways
+        if len(candidates) == 1:
+            return candidates[0]
+        if not any(g.available for g in candidates):
+            return min(candidates, key=lambda g: g.ejected_until)
+
+        if self.balance == self.LEAST_OUTSTANDING:
+            start = next(self._round_robin)
+            return min(
+                (
+                    candidates[(start + i) % len(candidates)]
+                    for i in range(len(candidates))
+                ),
+                key=lambda g: g.outstanding,
+            )
+        if self.balance == self.LATENCY:
+            known = [g.latency for g in candidates if g.latency]
+            # 还没有延迟数据的网关按已知最快的网关对待，保证它能被选中
+            fastest = min(known) if known else 1.0
+            weights = [1.0 / (g.latency or fastest) for g in candidates]
+            return random.choices(candidates, weights)[0]
+        return candidates[next(self._round_robin) % len(candidates)]
+
+    @contextmanager
+    def _connection(
+        self, gateway: Gateway = None, timed: bool = True, fresh: bool = False
+    ):
+        """
+        从选中网关的连接池中取出一个连接，使用完毕后归还，
+        出现网关错误时关闭连接并记录失败；
+        从连接池中取出的连接（reused）出错时不记录失败，而是丢弃该网关所有的空闲连接，
+        并抛出 StaleConnectionError，由调用方在新建的连接上重试
+
+        :param gateway: 指定网关，为空时按负载均衡策略选择
+        :param timed: 是否将耗时计入网关的平均延迟，扫描这类长时间占用连接的操作不计入
+        :param fresh: 是否新建连接，而不是使用空闲连接
+        :return:
+        """
+        gateway = gateway or self._pick_gateway()
+        try:
+            connection = gateway.acquire(fresh)
+        except GATEWAY_ERRORS:
+            gateway.mark_failure()
+            raise
+        begin = time.perf_counter()
+        try:
+            yield connection
+        except GATEWAY_ERRORS as e:
+            gateway.release(connection, broken=True)
+            if connection.reused:
+                gateway.discard_idle()
+                raise StaleConnectionError(message=str(e)) from e
+            gateway.mark_failure()
+            raise
+        except BaseException:
+            gateway.release(connection)
+            raise
+        gateway.release(connection)
+        gateway.mark_success(time.perf_counter() - begin if timed else None)
+
+    def _call(self, method: str, *args):
+        """
+        在负载均衡选出的网关上调用 THBaseService 的方法
+
+        :param method: THBaseService.Iface 中的方法名
+        :param args:
+        :return:
+        """
+        return self._call_on(self._pick_gateway(), method, *args)[0]
+
+    def _call_on(self, gateway: Gateway, method: str, *args):
+        """
+        在指定网关上调用 THBaseService 的方法，返回 (结果, 耗时)，
+        池中的连接已失效时在新建的连接上重试一次
+        """
+        begin = time.perf_counter()
+        try:
+            with self._connection(gateway) as connection:
+                result = self._invoke(connection.client, method, *args)
+        except StaleConnectionError:
+            with self._connection(gateway, fresh=True) as connection:
+                result = self._invoke(connection.client, method, *args)
+        return result, time.perf_counter() - begin
+
+    def _get_executor(self, name: str, workers: int, prefix: str) -> ThreadPoolExecutor:
+        """
+        按需创建的线程池，name 为保存线程池的属性名
+        """
+        with self._executor_lock:
+            executor = getattr(self, name)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=prefix
+                )
+                setattr(self, name, executor)
+            return executor
+
+    def _hedge_wait(self, method: str) -> float:
+        """
+        method 当前的对冲等待时间，即其延迟的 hedge_percentile 分位数，
+        每 HEDGE_MIN_SAMPLES 次请求重新计算一次
+        """
+        with self._hedge_lock:
+            state = self._hedge_latency.get(method)
+            if state is None or state[0].count < self.HEDGE_MIN_SAMPLES:
+                return self.hedge_delay
+            if state[2] <= 0:
+                state[1] = state[0].percentile(self.hedge_percentile)
+                state[2] = self.HEDGE_MIN_SAMPLES
+            return state[1]
+
+    def _hedge_record(self, method: str, future):
+        """
+        记录每个成功的请求（包括没有被采用的）的耗时，作为计算对冲等待时间的样本
+        """
+        if future.cancelled() or future.exception() is not None:
+            return
+        elapsed = future.result()[1]
+        with self._hedge_lock:
+            state = self._hedge_latency.get(method)
+            if state is None:
+                state = self._hedge_latency[method] = [Histogram(), self.hedge_delay, 0]
+            state[0].record(elapsed)
+            state[2] -= 1
+
+    def _hedge_acquire(self) -> bool:
+        """
+        从对冲预算中取出一次，预算按每个读请求 hedge_ratio 的速度积累，最多积累 HEDGE_BURST 次
+        """
+        with self._hedge_lock:
+            if self._hedge_tokens < 1:
+                return False
+            self._hedge_tokens -= 1
+            return True
+
+    def _read(self, method: str, *args):
+        """
+        读请求，开启了对冲读取时，在等待 _hedge_wait 之后还没有返回的请求，
+        会在预算允许的情况下向另一个网关再发送一次，返回先成功的结果，
+        两个请求都失败时抛出主请求的异常；未开启时与 _call 相同
+
+        :param method:
+        :param args:
+        :return:
+        """
+        if self.hedge_percentile is None or len(self.gateways) < 2:
+            return self._call(method, *args)
+        with self._hedge_lock:
+            self._hedge_tokens = min(
+                self._hedge_tokens + self.hedge_ratio, self.HEDGE_BURST
+            )
+
+        executor = self._get_executor(
+            "_hedge_executor", self.HEDGE_WORKERS, "hbase-hedge"
+        )
+        record = partial(self._hedge_record, method)
+        primary = self._pick_gateway()
+        futures = [executor.submit(self._call_on, primary, method, *args)]
+        futures[0].add_done_callback(record)
+        done, _ = wait(futures, timeout=self._hedge_wait(method))
+        if not done and self._hedge_acquire():
+            secondary = self._pick_gateway(exclude=(primary,))
+            futures.append(executor.submit(self._call_on, secondary, method, *args))
+            futures[1].add_done_callback(record)
+            if self.metrics is not None:
+                self.metrics.incr("hedged_requests")
+
+        pending = futures
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0] and self.metrics is not None:
+                        self.metrics.incr("hedge_wins")
+                    return future.result()[0]
+        return futures[0].result()[0]
+
+    def _invoke(self, client: THBaseService.Client, method: str, *args):
+        """
+        调用 THBaseService 的方法，指定了 metrics 时记录耗时和错误
+
+        :param client:
+        :param method:
+        :param args:
+        :return:
+        """
+        if self.metrics is None:
+            return getattr(client, method)(*args)
+        begin = time.perf_counter()
+        ok = False
+        try:
+            result = getattr(client, method)(*args)
+            ok = True
+            return result
+        finally:
+            self.metrics.record(method, time.perf_counter() - begin, ok)
+
+    @staticmethod
+    def parse_durability(durability: Union[int, str, None]) -> Optional[int]:
+        """
+        将 TDurability 的名称转换为对应的值
+
+        :param durability:
+        :return:
+        """
+        if isinstance(durability, str):
+            return TDurability._NAMES_TO_VALUES[durability.upper()]
+        return durability
+
+    def get_durability(
+        self, table: str, durability: Union[int, str] = None
+    ) -> Optional[int]:
+        """
+        获取写入 table 时实际使用的 durability，
+        优先级：本次调用指定 > 表级默认 > 客户端默认
+
+        :param table:
+        :param durability:
+        :return:
+        """
+        if durability is not None:
+            return self.parse_durability(durability)
+        return self.table_durability.get(table, self.durability)
 
     @staticmethod
-    def decode_row_value(row_data: TResult) -> dict:
+    def decode_row_value(row_data: TResult, versioned: bool = False) -> dict:
         """
-        将 HBase 数据结构解码为 Python dict
+        将 HBase 数据结构解码为 Python dict，
+        versioned 为 True 时保留单元格的所有版本及其时间戳，
+        每个单元格解码为 [(<timestamp>, <value>), ...]，按服务端返回的顺序（新版本在前）
 
         :param row_data:
+        :param versioned: 是否保留多版本
         :return:
         """
         row_value = {}
@@ -125,38 +1231,131 @@ class HBaseClient(object):
                 column.qualifier.decode(),
                 column.value.decode(),
             )
-            if cf in row_value.keys():
-                row_value[cf][cq] = cv
+            if cf not in row_value:
+                row_value[cf] = {}
+            if versioned:
+                cells = row_value[cf].get(cq)
+                if cells is None:
+                    cells = row_value[cf][cq] = []
+                cells.append((column.timestamp, cv))
             else:
-                row_value[cf] = {cq: cv}
+                row_value[cf][cq] = cv
         return row_value
 
+    def register_schema(self, table: str, schema: "TableSchema"):
+        """
+        为 table 注册表结构，之后该表的 get_row/get_rows/put_row/put_rows/scan_row
+        都按表结构中每一列声明的类型编解码，不再使用 typed 参数
+
+        :param table:
+        :param schema: hbase_schema.TableSchema，为 None 时取消注册
+        :return:
+        """
+        if schema is None:
+            self.schemas.pop(table, None)
+        else:
+            self.schemas[table] = schema
+
+    def _decoder(self, table: str):
+        """
+        table 使用的解码函数，参数与 decode_row_value 相同
+        """
+        schema = self.schemas.get(table)
+        return self.decode_row_value if schema is None else schema.decode_row
+
+    def _view(self, table: str, versioned: bool = False):
+        """
+        table 使用的 RowView 构造函数，参数为 TResult
+        """
+        schema = self.schemas.get(table)
+        decode = None if schema is None else schema.decode_cell
+        return lambda row_data: RowView(row_data, decode, versioned)
+
+    def encode_row(
+        self, table: str, row_value: dict, typed: bool = False
+    ) -> List[TColumnValue]:
+        """
+        按 table 的编码方式将 Python dict 编码为 TColumnValue 结构，
+        table 注册了 schema 时使用 schema 编码（忽略 typed），否则同 encode_row_value
+
+        :param table:
+        :param row_value:
+        :param typed: 见 encode_row_value
+        :return:
+        """
+        schema = self.schemas.get(table)
+        if schema is None:
+            return self.encode_row_value(row_value, typed)
+        return schema.encode_row(row_value)
+
     @staticmethod
-    def encode_row_value(row_value: dict) -> List[TColumnValue]:
+    def make_time_range(time_range: Tuple[int, int] = None) -> Optional[TTimeRange]:
+        """
+        将 (<起始时间戳>, <结束时间戳>) 转换为 TTimeRange，区间左闭右开，
+        任一端为 None 表示不限制
+
+        :param time_range:
+        :return:
         """
-        将 Python dict 编码为 HBase TColumnValue 结构
+        if time_range is None:
+            return None
+        min_stamp, max_stamp = time_range
+        return TTimeRange(
+            minStamp=0 if min_stamp is None else min_stamp,
+            maxStamp=MAX_TIMESTAMP if max_stamp is None else max_stamp,
+        )
+
+    @staticmethod
+    def encode_row_value(row_value: dict, typed: bool = False) -> List[TColumnValue]:
+        """
+        将 Python dict 编码为 HBase TColumnValue 结构，
+        不会修改传入的 row_value，其中的 row_key 会被跳过；
+        bytes/bytearray/memoryview 类型的值不做任何转换直接写入，
+        HBaseClient 使用的 TBinaryProtocol 可以直接序列化这三种类型，
+        但 TBinaryProtocolAccelerated 只接受 bytes，自行用它序列化结果时需要先转换为 bytes；
+        typed 为 True 时 int/float/bool 按 HBase Bytes.toBytes 的格式编码为二进制，
+        否则与其他类型一样以 str() 的结果写入。
 
         :param row_value:
+        :param typed: 是否对 int/float/bool 使用二进制编码
         :return:
         """
         row_data = []
-        if "row_key" in row_value.keys():
-            row_value.pop("row_key")
+        append = row_data.append
+        names = _NAME_CACHE
+        pack_long, pack_double = LONG_CODEC.pack, DOUBLE_CODEC.pack
         for column_family, column_data in row_value.items():
-            row_data.extend(
-                [
-                    TColumnValue(
-                        family=column_family.encode(),
-                        qualifier=k.encode(),
-                        value=str(v).encode(),
-                    )
-                    for k, v in column_data.items()
-                ]
-            )
+            if column_family == "row_key":
+                continue
+            family = names.get(column_family)
+            if family is None:
+                family = _encode_name(column_family)
+            for k, v in column_data.items():
+                qualifier = names.get(k)
+                if qualifier is None:
+                    qualifier = _encode_name(k)
+                value_type = type(v)
+                if value_type is str:
+                    v = v.encode()
+                elif value_type in BINARY_TYPES:
+                    pass
+                elif not typed:
+                    v = str(v).encode()
+                elif value_type is int:
+                    v = pack_long(v)
+                elif value_type is float:
+                    v = pack_double(v)
+                else:
+                    v = encode_value(v, True)
+                column = _TColumnValue()
+                column.family = family
+                column.qualifier = qualifier
+                column.value = v
+                append(column)
 
         return row_data
 
-    @retry(ignore_exception=True)
+    @retry(ignore_exception=True, on_retry=_count_retry)
     def is_row_exist(self, table: str, row_key: str) -> bool:
         """
         验证 table 中是否存在 key 为 row_key 的 row，
@@ -167,10 +1366,16 @@ class HBaseClient(object):
         """
         get = TGet()
         get.row = row_key.encode()
-        return self.client.exists(table.encode(), get)
+        return self._read("exists", table.encode(), get)
 
-    @retry(ignore_exception=True)
-    def get_row(self, table: str, row_key: str) -> dict:
+    @retry(ignore_exception=True, on_retry=_count_retry)
+    def get_row(
+        self,
+        table: str,
+        row_key: str,
+        max_versions: int = None,
+        time_range: Tuple[int, int] = None,
+    ) -> dict:
         """
         根据 row_key 从 table 中 取值，
         返回格式为：
@@ -185,18 +1390,102 @@ class HBaseClient(object):
                 ...
             }
         }
+        指定 max_versions 时，一次请求取回每个单元格的多个版本，
+        <cell> 的格式为 [(<timestamp>, <value>), ...]，新版本在前。
 
         :param table:
         :param row_key:
+        :param max_versions: 每个单元格最多返回的版本数
+        :param time_range: 只返回时间戳在 [起始, 结束) 之间的版本
         :return:
         """
         get = TGet()
         get.row = row_key.encode()
-        row_data = self.client.get(table.encode(), get)
-        return {"row_key": row_key, **self.decode_row_value(row_data)}
+        get.maxVersions = max_versions
+        get.timeRange = self.make_time_range(time_range)
+        row_data = self._read("get", table.encode(), get)
+        return {
+            "row_key": row_key,
+            **self._decoder(table)(row_data, max_versions is not None),
+        }
 
-    @retry(max_retry=3, delay=1, ignore_exception=True)
-    def put_row(self, table: str, row_key: str, row_value: Dict):
+    @retry(ignore_exception=True, on_retry=_count_retry)
+    def get_rows(
+        self,
+        table: str,
+        row_keys: List[str],
+        max_versions: int = None,
+        time_range: Tuple[int, int] = None,
+    ) -> List[dict]:
+        """
+        通过一次 getMultiple 请求从 table 中批量取值，
+        返回列表的顺序与 row_keys 一致，每一项的格式与 get_row 相同，
+        不存在的 row 只包含 row_key
+
+        :param table:
+        :param row_keys:
+        :param max_versions: 每个单元格最多返回的版本数
+        :param time_range: 只返回时间戳在 [起始, 结束) 之间的版本
+        :return:
+        """
+        t_time_range = self.make_time_range(time_range)
+        gets = [
+            TGet(row=row_key.encode(), maxVersions=max_versions, timeRange=t_time_range)
+            for row_key in row_keys
+        ]
+        rows_data = self._read("getMultiple", table.encode(), gets)
+        versioned = max_versions is not None
+        decode = self._decoder(table)
+        return [
+            {"row_key": row_key, **decode(row_data, versioned)}
+            for row_key, row_data in zip(row_keys, rows_data)
+        ]
+
+    def get_many(
+        self,
+        tables: Dict[str, List[str]],
+        max_versions: int = None,
+        time_range: Tuple[int, int] = None,
+    ) -> Dict[str, List[dict]]:
+        """
+        同时从多张表批量取值，每张表一次 getMultiple，各表的请求从连接池中取不同的连接并发执行，
+        总耗时约等于最慢的一次请求而不是所有请求之和，
+        返回 {<table>: <get_rows 的结果>}，某张表重试之后仍然失败时对应的值为 None
+
+        :param tables: {<table>: [<row_key>, ...]}
+        :param max_versions: 同 get_rows
+        :param time_range: 同 get_rows
+        :return:
+        """
+        items = list(tables.items())
+        if not items:
+            return {}
+        executor = self._get_executor("_executor", self.FANOUT_WORKERS, "hbase-fanout")
+        futures = [
+            (
+                table,
+                executor.submit(
+                    self.get_rows, table, row_keys, max_versions, time_range
+                ),
+            )
+            for table, row_keys in items[1:]
+        ]
+        # 第一张表在当前线程中请求，少占用一个线程
+        table, row_keys = items[0]
+        results = {table: self.get_rows(table, row_keys, max_versions, time_range)}
+        for table, future in futures:
+            results[table] = future.result()
+        return results
+
+    @retry(max_retry=3, delay=1, ignore_exception=True, on_retry=_count_retry)
+    def put_row(
+        self,
+        table: str,
+        row_key: str,
+        row_value: Dict,
+        typed: bool = False,
+        durability: Union[int, str] = None,
+    ):
         """
         根据 row_key 向 table 中插入值，
         值(row_value)的形式为：
@@ -214,11 +1503,57 @@ class HBaseClient(object):
         :param table:
         :param row_key:
         :param row_value:
+        :param typed: 是否对 int/float/bool 使用二进制编码，见 encode_row_value，注册了表结构时不使用
+        :param durability: 本次写入使用的 TDurability，为空则使用表级或客户端默认值，
+                SKIP_WAL/ASYNC_WAL 可以大幅提高写入速度，但 RegionServer 宕机时可能丢失数据
+        :return:
+        """
+        column_value = self.encode_row(table, row_value, typed)
+        t_put = TPut(
+            row_key.encode(),
+            column_value,
+            durability=self.get_durability(table, durability),
+        )
+        self._call("put", table.encode(), t_put)
+
+    @retry(max_retry=3, delay=1, ignore_exception=True, on_retry=_count_retry)
+    def put_rows(
+        self,
+        table: str,
+        rows: Union[Dict[str, Dict], List[TPut]],
+        typed: bool = False,
+        durability: Union[int, str] = None,
+    ) -> int:
+        """
+        通过一次 putMultiple 请求向 table 中批量插入多行，
+        rows 可以是 {<row_key>: <row_value>, ...} 形式的字典，
+        也可以是已经编码好的 TPut 列表。
+        重试之后仍然失败时返回 None，成功时返回写入的行数。
+
+        :param table:
+        :param rows:
+        :param typed: 是否对 int/float/bool 使用二进制编码，见 encode_row_value，注册了表结构时不使用
+        :param durability: 同 put_row，只会设置到没有指定 durability 的 TPut 上
         :return:
         """
-        column_value = self.encode_row_value(row_value)
-        t_put = TPut(row_key.encode(), column_value)
-        self.client.put(table.encode(), t_put)
+        durability = self.get_durability(table, durability)
+        if isinstance(rows, dict):
+            t_puts = [
+                TPut(
+                    row_key.encode(),
+                    self.encode_row(table, row_value, typed),
+                    durability=durability,
+                )
+                for row_key, row_value in rows.items()
+            ]
+        else:
+            t_puts = rows
+            if durability is not None:
+                for t_put in t_puts:
+                    if t_put.durability is None:
+                        t_put.durability = durability
+        self._call("putMultiple", table.encode(), t_puts)
+        return len(t_puts)
 
     def del_row(self, table: str, row_key: str, **kwargs):
         """
@@ -230,27 +1565,137 @@ class HBaseClient(object):
         :param kwargs:
         :return:
         """
-        self.client.deleteSingle(
+        self._call(
+            "deleteSingle",
             table.encode(),
             TDelete(row=row_key.encode(), **kwargs),
         )
 
+    @staticmethod
+    def result_size(row_data: TResult) -> int:
+        """
+        估算一个 TResult 的字节数，即行键和所有单元格 family/qualifier/value 的长度之和
+
+        :param row_data:
+        :return:
+        """
+        return len(row_data.row or b"") + sum(
+            len(c.family) + len(c.qualifier) + len(c.value)
+            for c in row_data.columnValues
+        )
+
+    def scan_results(
+        self,
+        table: str,
+        t_scan: TScan,
+        chunk: int = 10,
+        max_bytes: int = None,
+    ) -> Generator:
+        """
+        使用 TScan 扫描 table，以生成器形式返回原始的 TResult，
+        指定 max_bytes 时按目前见过的最大一行的大小动态调整每次请求的行数，
+        使单次请求返回的数据量尽量不超过 max_bytes（至少返回一行），
+        单行本身可能超过预算时应配合 TScan.batchSize 使用
+
+        :param table:
+        :param t_scan:
+        :param chunk: 每次请求的最大行数
+        :param max_bytes: 每次请求返回数据量的上限，字节
+        :return:
+        """
+        # scanner 只存在于打开它的网关上，整个扫描过程占用同一个连接
+        gateway = self._pick_gateway()
+        try:
+            with self._connection(gateway, timed=False) as connection:
+                yield from self._scan_on(connection, table, t_scan, chunk, max_bytes)
+        except StaleConnectionError:
+            # openScanner 之前还没有返回任何数据，可以在新建的连接上重新打开
+            with self._connection(gateway, timed=False, fresh=True) as connection:
+                yield from self._scan_on(connection, table, t_scan, chunk, max_bytes)
+
+    def _scan_on(
+        self,
+        connection: Connection,
+        table: str,
+        t_scan: TScan,
+        chunk: int,
+        max_bytes: int,
+    ) -> Generator:
+        """
+        scan_results 在 connection 上的扫描过程
+        """
+        client = connection.client
+        scanner = self._invoke(client, "openScanner", table.encode(), t_scan)
+        # 连接已经确认可用，之后的错误按网关的失败处理，不能重试，否则会重复返回数据
+        connection.reused = False
+        if self.metrics is not None:
+            self.metrics.incr("scanner_opens")
+        try:
+            # 还不知道行的大小时先只取一行
+            num_rows = 1 if max_bytes else chunk
+            largest = 1
+            row_generator = self._invoke(client, "getScannerRows", scanner, num_rows)
+            while row_generator:
+                if max_bytes:
+                    largest = max(
+                        largest, *(self.result_size(r) for r in row_generator)
+                    )
+                    num_rows = max(1, min(chunk, max_bytes // largest))
+                yield from row_generator
+                # 释放本批数据的引用，避免与下一批同时占用内存
+                row_generator = None
+                row_generator = self._invoke(
+                    client, "getScannerRows", scanner, num_rows
+                )
+        finally:
+            self._invoke(client, "closeScanner", scanner)
+
     def scan_row(
         self,
         table: str,
         start_at: str = None,
         end_at: str = None,
         chunk: int = 10,
+        max_versions: int = None,
+        time_range: Tuple[int, int] = None,
+        max_bytes: int = None,
+        batch_size: int = None,
+        allow_partial: bool = False,
+        reversed: bool = False,
+        limit: int = None,
+        lazy: bool = False,
         **kwargs,
     ) -> Generator:
         """
         扫描 table，结果以生成器形式返回，
-        可以指定扫描开始/结束的 row_key
+        可以指定扫描开始/结束的 row_key，
+        指定 max_versions 时每个单元格的格式与 get_row 相同，为 [(<timestamp>, <value>), ...]
+
+        reversed 为 True 时从大到小倒序扫描，此时 start_at 应大于 end_at（同样是包含 start_at，不包含 end_at）；
+        limit 由服务端限制返回的行数，"最新的 N 条" 这类查询配合倒序扫描只需要读取 N 行
+
+        对于很宽的行，可以用以下参数限制内存占用：
+            - max_bytes: 单次请求返回的数据量上限，见 scan_results
+            - batch_size: 服务端将一行拆分为多个结果返回，每个结果最多包含 batch_size 个单元格
+            - allow_partial: 为 False 时，被拆分的同一行会在客户端重新合并后返回；
+              为 True 时直接返回拆分后的部分行，后面还有同一行的数据时 "partial" 为 True，
+              此时内存占用与行的宽度无关
+
+        lazy 为 True 时返回 RowView 而不是字典，只在访问某个单元格时才解码，
+        只用到少数几列的扫描可以省去大部分解码和内存分配
 
         :param table:
-        :param start_at:
-        :param end_at:
+        :param start_at: str 或 bytes
+        :param end_at: str 或 bytes
         :param chunk: 扫描分块大小，即一次扫描请求的数据量，太大或太小都会影响效率
+        :param max_versions: 每个单元格最多返回的版本数
+        :param time_range: 只返回时间戳在 [起始, 结束) 之间的版本
+        :param max_bytes: 单次请求返回的数据量上限，字节
+        :param batch_size: 每个结果最多包含的单元格数
+        :param allow_partial: 是否直接返回部分行
+        :param reversed: 是否倒序扫描
+        :param limit: 最多返回的行数
+        :param lazy: 是否返回 RowView
         :param kwargs:
         :return:
         """
@@ -260,24 +1705,408 @@ class HBaseClient(object):
             kwargs["stopRow"] = end_at
         t_scan = TScan(
             **{
-                k: v.encode() if type(v) == str else str(v).encode()
+                k: (
+                    v
+                    if isinstance(v, bytes)
+                    else v.encode() if isinstance(v, str) else str(v).encode()
+                )
                 for k, v in kwargs.items()
             }
         )
+        versioned = max_versions is not None
+        if versioned:
+            t_scan.maxVersions = max_versions
+        # 只在指定了参数时设置，不覆盖 kwargs 中传入的值
+        if time_range is not None:
+            t_scan.timeRange = self.make_time_range(time_range)
+        if batch_size is not None:
+            t_scan.batchSize = batch_size
+        if reversed:
+            t_scan.reversed = True
+        if limit:
+            t_scan.limit = limit
+            # 不需要请求比 limit 更多的行
+            chunk = min(chunk, limit)
+
+        if lazy:
+            make_row = self._view(table, versioned)
+        else:
+            decode = self._decoder(table)
+
+            def make_row(row_data: TResult) -> dict:
+                row = {"row_key": row_data.row.decode(), **decode(row_data, versioned)}
+                if row_data.partial:
+                    row["partial"] = True
+                return row
+
+        results = self.scan_results(table, t_scan, chunk, max_bytes)
+        if allow_partial:
+            yield from map(make_row, results)
+            return
+
+        # 连续返回的同一行的多个部分合并为一行
+        pending = None
+        for row_info in results:
+            if pending is not None and pending.row == row_info.row:
+                pending.columnValues.extend(row_info.columnValues)
+                continue
+            if pending is not None:
+                pending.partial = False
+                yield make_row(pending)
+            pending = row_info
+        if pending is not None:
+            pending.partial = False
+            yield make_row(pending)
+
+    def scan_partitions(
+        self,
+        table: str,
+        start_at: Union[str, bytes] = None,
+        end_at: Union[str, bytes] = None,
+        split_keys: List[bytes] = None,
+    ) -> List[Tuple[Optional[bytes], Optional[bytes]]]:
+        """
+        将 [start_at, end_at) 按 region 边界（或指定的分割点）划分为多个扫描范围
+
+        :param table:
+        :param start_at:
+        :param end_at:
+        :param split_keys: 分割点，为空时使用 table 当前各 region 的起始 row_key
+        :return: [(start, end), ...]，首尾的 None 表示不限制
+        """
+        if split_keys is None:
+            locations = self._call("getAllRegionLocations", table.encode())
+            split_keys = [location.regionInfo.startKey for location in locations]
+        start = start_at.encode() if isinstance(start_at, str) else start_at or None
+        end = end_at.encode() if isinstance(end_at, str) else end_at or None
+        keys = sorted(
+            {
+                key
+                for key in split_keys
+                if key and (start is None or key > start) and (end is None or key < end)
+            }
+        )
+        bounds = [start, *keys, end]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def _run_scan_workers(
+        self,
+        table: str,
+        func,
+        reducer,
+        processes: int = None,
+        start_at: Union[str, bytes] = None,
+        end_at: Union[str, bytes] = None,
+        split_keys: List[bytes] = None,
+        batch_size: int = 100,
+        context: str = None,
+        **kwargs,
+    ) -> Generator:
+        """
+        启动工作进程并行扫描各个分片，以生成器形式返回工作进程发回的 (类型, 数据)，
+        任一工作进程出错时终止所有进程并抛出 RuntimeError
+        """
+        partitions = self.scan_partitions(table, start_at, end_at, split_keys)
+        processes = max(1, min(processes or os.cpu_count() or 1, len(partitions)))
+        ctx = multiprocessing.get_context(context)
+        tasks = ctx.Queue()
+        # 有上限的结果队列，主进程消费跟不上时阻塞工作进程
+        results = ctx.Queue(maxsize=processes * 4)
+        for partition in partitions:
+            tasks.put(partition)
+        for _ in range(processes):
+            tasks.put(None)
 
-        scanner = self.client.openScanner(table.encode(), t_scan)
-        row_generator = self.client.getScannerRows(scanner, chunk)
-        while row_generator:
-            for row_info in row_generator:
-                yield {
-                    "row_key": row_info.row.decode(),
-                    **self.decode_row_value(row_info),
-                }
-            row_generator = self.client.getScannerRows(scanner, chunk)
+        gateways = [(gateway.host, gateway.port) for gateway in self.gateways]
+        options = {
+            "balance": self.balance,
+            "timeout": self.gateways[0].timeout,
+            "schemas": self.schemas,
+            "keepalive": self.gateways[0].keepalive,
+            "nodelay": self.gateways[0].nodelay,
+            "max_idle": self.gateways[0].max_idle,
+        }
+        workers = [
+            ctx.Process(
+                target=_scan_worker,
+                args=(
+                    gateways,
+                    options,
+                    table,
+                    tasks,
+                    results,
+                    func,
+                    reducer,
+                    batch_size,
+                    kwargs,
+                ),
+                name="hbase-scan-worker-{}".format(i),
+                daemon=True,
+            )
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        try:
+            done = 0
+            while done < processes:
+                try:
+                    kind, payload = results.get(timeout=1)
+                except queue.Empty:
+                    if all(not worker.is_alive() for worker in workers):
+                        raise RuntimeError("scan worker exited unexpectedly")
+                    continue
+                if kind == "error":
+                    raise RuntimeError("scan worker failed:\n{}".format(payload))
+                if kind == "done":
+                    done += 1
+                yield kind, payload
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+
+    def scan_map(
+        self,
+        table: str,
+        func,
+        processes: int = None,
+        start_at: Union[str, bytes] = None,
+        end_at: Union[str, bytes] = None,
+        split_keys: List[bytes] = None,
+        batch_size: int = 100,
+        context: str = None,
+        **kwargs,
+    ) -> Generator:
+        """
+        多进程并行扫描 table 并对每一行执行 func，以生成器形式返回 func 的结果（不保证顺序），
+        func 返回 None 的行会被丢弃，可以同时用作过滤。
+        扫描范围按 region 边界划分为多个分片，由 processes 个工作进程各自建立连接分别扫描，
+        CPU 密集的 func 不再受 GIL 限制；结果在工作进程中按 batch_size 分批发回。
+
+        使用 spawn/forkserver 方式启动进程时，func 和注册的表结构需要能够被 pickle（如模块级函数）
+
+        :param table:
+        :param func: 行的处理函数，参数为 scan_row 返回的一行
+        :param processes: 工作进程数，默认为 CPU 核数，不超过分片数
+        :param start_at: 同 scan_row
+        :param end_at: 同 scan_row
+        :param split_keys: 分片的分割点，默认使用 region 边界，region 较少时可以手动指定
+        :param batch_size: 每批发回的结果数
+        :param context: multiprocessing 的启动方式，如 "fork"/"spawn"，默认使用系统默认值
+        :param kwargs: 其他传给 scan_row 的参数
+        :return:
+        """
+        messages = self._run_scan_workers(
+            table,
+            func,
+            None,
+            processes,
+            start_at,
+            end_at,
+            split_keys,
+            batch_size,
+            context,
+            **kwargs,
+        )
+        for kind, payload in messages:
+            if kind == "batch":
+                yield from payload
+
+    def scan_reduce(
+        self,
+        table: str,
+        func,
+        reducer,
+        initial=None,
+        processes: int = None,
+        start_at: Union[str, bytes] = None,
+        end_at: Union[str, bytes] = None,
+        split_keys: List[bytes] = None,
+        context: str = None,
+        **kwargs,
+    ):
+        """
+        与 scan_map 相同地并行处理每一行，并用 reducer 聚合 func 的结果，
+        每个工作进程先在进程内聚合，主进程再用 reducer 合并各进程的聚合值，
+        所以 reducer 需要满足结合律，并且可以合并两个聚合值（如 operator.add、max）
+
+        :param table:
+        :param func: 同 scan_map
+        :param reducer: (聚合值, 结果) -> 聚合值
+        :param initial: 初始值，没有任何结果时返回该值
+        :param processes: 同 scan_map
+        :param start_at:
+        :param end_at:
+        :param split_keys:
+        :param context:
+        :param kwargs: 其他传给 scan_row 的参数
+        :return:
+        """
+        has_value, acc = initial is not None, initial
+        messages = self._run_scan_workers(
+            table,
+            func,
+            reducer,
+            processes,
+            start_at,
+            end_at,
+            split_keys,
+            1,
+            context,
+            **kwargs,
+        )
+        for kind, payload in messages:
+            if kind == "done" and payload[0]:
+                acc = reducer(acc, payload[1]) if has_value else payload[1]
+                has_value = True
+        return acc
+
+    @staticmethod
+    def next_prefix(prefix: bytes) -> Optional[bytes]:
+        """
+        计算大于所有以 prefix 开头的 row_key 的最小值，用作前缀扫描的结束位置，
+        prefix 全部由 0xff 组成时不存在这样的值，返回 None
+
+        :param prefix:
+        :return:
+        """
+        prefix = prefix.rstrip(b"\xff")
+        if not prefix:
+            return None
+        return prefix[:-1] + bytes([prefix[-1] + 1])
+
+    def scan_prefix(
+        self,
+        table: str,
+        prefix: str,
+        reversed: bool = False,
+        limit: int = None,
+        chunk: int = 10,
+        **kwargs,
+    ) -> Generator:
+        """
+        扫描 table 中 row_key 以 prefix 开头的行，
+        倒序扫描配合 limit 可以只读取最后（最新）的 limit 行，如：
+            scan_prefix("events", "entity_x|", reversed=True, limit=20)
+
+        :param table:
+        :param prefix:
+        :param reversed: 是否倒序扫描
+        :param limit: 最多返回的行数
+        :param chunk:
+        :param kwargs: 其他传给 scan_row 的参数
+        :return:
+        """
+        # 结束位置不一定是合法的 UTF-8（如 "\x7f" 的下一个前缀），以 bytes 传给 scan_row
+        encoded = prefix.encode()
+        stop = self.next_prefix(encoded)
+        if not reversed:
+            yield from self.scan_row(
+                table, prefix, stop, chunk=chunk, limit=limit, **kwargs
+            )
+            return
+
+        # 倒序扫描时结束位置不包含在内，会漏掉与 prefix 相同的 row_key，
+        # 所以不设置结束位置，在客户端遇到第一个小于 prefix 的行时停止；
+        # 开始位置 stop 本身可能存在且不属于该前缀，需要多取一行并跳过
+        rows = self.scan_row(
+            table,
+            stop,
+            chunk=chunk,
+            reversed=True,
+            limit=limit + 1 if limit else None,
+            **kwargs,
+        )
+        count = 0
+        for row in rows:
+            row_key = row["row_key"].encode()
+            if row_key.startswith(encoded):
+                yield row
+                count += 1
+                if limit and count >= limit:
+                    break
+            elif row_key < encoded:
+                break
+
+    def tail(
+        self,
+        table: str,
+        since_ts: int = None,
+        poll_interval: Union[int, float] = 1,
+        checkpoint: str = None,
+        lag: int = 5000,
+        chunk: int = 100,
+        max_versions: int = None,
+        **kwargs,
+    ) -> Generator:
+        """
+        持续增量扫描 table 中新写入的数据，以生成器形式不断返回发生变化的行，
+        每一轮只扫描时间戳在 [水位, 当前时间 - lag) 之间的单元格，扫描完成后把水位推进到本轮的上界，
+        行的格式与 scan_row 相同，只包含本轮时间范围内写入的单元格；
+        client 关闭后生成器结束。
+
+        指定 checkpoint 时水位会在每一轮结束后持久化，重启后从检查点继续（优先于 since_ts），
+        一轮没有消费完就中断时会从该轮开头重新扫描，即至少一次（at-least-once）。
+
+        注意：
+            - 依赖单元格的时间戳，写入时显式指定了较早时间戳的数据不会被扫描到
+            - 删除操作不会出现在结果中
+            - 单元格的时间戳在写入 RegionServer 时确定，但要等写入完成后才能被扫描到，
+              RegionServer 之间还存在时钟偏差，上界贴近当前时间时会漏掉这些稍晚可见的写入，
+              lag 需要大于写入延迟与时钟偏差之和，默认留出 5 秒
+
+        :param table:
+        :param since_ts: 起始水位，毫秒时间戳，为空时从当前时间开始
+        :param poll_interval: 两轮扫描之间的间隔，秒
+        :param checkpoint: 持久化水位的文件路径
+        :param lag: 每轮扫描的上界比当前时间早多少毫秒，不建议设为 0
+        :param chunk: 同 scan_row
+        :param max_versions: 同 scan_row，为空时每个单元格只返回本轮范围内最新的版本
+        :param kwargs: 其他传给 scan_row 的参数
+        :return:
+        """
+        watermark = read_checkpoint(checkpoint)
+        if watermark is None:
+            watermark = int(time.time() * 1000) if since_ts is None else since_ts
+
+        while not self._closed.is_set():
+            upper = int(time.time() * 1000) - lag
+            if upper > watermark:
+                try:
+                    yield from self.scan_row(
+                        table,
+                        chunk=chunk,
+                        max_versions=max_versions,
+                        time_range=(watermark, upper),
+                        **kwargs,
+                    )
+                except GATEWAY_ERRORS:
+                    # 下一轮从同一水位重新扫描
+                    self._closed.wait(poll_interval)
+                    continue
+                watermark = upper
+                if checkpoint:
+                    write_checkpoint(checkpoint, watermark)
+            self._closed.wait(poll_interval)
 
 
 if __name__ == "__main__":
-    with HBaseClient("localhost", 9090) as hc:
+    import operator
+
+    with HBaseClient(
+        ["gateway01:9090", "gateway02:9090"],
+        balance=HBaseClient.LEAST_OUTSTANDING,
+        table_durability={"YOUR_BACKFILL_TABLE": "ASYNC_WAL"},
+        metrics=HBaseMetrics(),
+        keepalive=60,
+        nodelay=True,
+        max_idle=50,
+        warmup=4,
+    ) as hc:
+        print(hc.ping())
+
         data = {
             "cf01": {
                 "ck01": "cv01",
@@ -288,6 +2117,9 @@ if __name__ == "__main__":
         # put
         hc.put_row("YOUR_TABLE_NAME", "row_key_01", data)
 
+        # put multiple rows
+        hc.put_rows("YOUR_TABLE_NAME", {"row_key_02": data, "row_key_03": data})
+
         # exist
         print(hc.is_row_exist("YOUR_TABLE_NAME", "row_key_01"))
 
@@ -295,10 +2127,51 @@ if __name__ == "__main__":
         row = hc.get_row("YOUR_TABLE_NAME", "row_key_01")
         print(row)
 
+        # get multiple rows in one request
+        rows = hc.get_rows("YOUR_TABLE_NAME", ["row_key_01", "row_key_02"])
+        print(rows)
+
+        # get from several tables concurrently
+        print(
+            hc.get_many(
+                {"YOUR_TABLE_NAME": ["row_key_01"], "YOUR_OTHER_TABLE": ["k1", "k2"]}
+            )
+        )
+
+        # get history of every cell in one request
+        row = hc.get_row("YOUR_TABLE_NAME", "row_key_01", max_versions=10)
+        print(row)
+
         # scan
         h_scanner = hc.scan_row("YOUR_TABLE_NAME", end_at="row_key_01")
         for row in h_scanner:
             print(row)
 
+        # latest 20 rows of an entity
+        for row in hc.scan_prefix(
+            "YOUR_TABLE_NAME", "entity_x|", reversed=True, limit=20
+        ):
+            print(row)
+
+        # scan very wide rows with bounded memory
+        h_scanner = hc.scan_row(
+            "YOUR_TABLE_NAME", chunk=100, max_bytes=16 * 1024 * 1024, batch_size=1000
+        )
+        for row in h_scanner:
+            print(row["row_key"])
+
         # delete
         hc.del_row("YOUR_TABLE_NAME", "row_key_01")
+
+        # transform rows on all cores
+        for result in hc.scan_map("YOUR_TABLE_NAME", len, processes=4):
+            print(result)
+        print(hc.scan_reduce("YOUR_TABLE_NAME", lambda row: 1, operator.add, initial=0))
+
+        # follow changes, resumable from the checkpoint file
+        for row in hc.tail("YOUR_TABLE_NAME", checkpoint="YOUR_TABLE_NAME.watermark"):
+            print(row)
+            break
+
+        # metrics
+        print(hc.metrics.render_prometheus())
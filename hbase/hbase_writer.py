@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Author : Sz
+@Project: rtg-tools
+@File   : hbase_writer.py
+@Time   : 2020/10/26 0026 10:15
+"""
+import threading
+from typing import Any, Callable, Dict, Union
+
+from hbase.hbase_tools import HBaseClient
+
+
+def last_write_wins(old: Any, new: Any) -> Any:
+    return new
+
+
+class BufferedWriter(object):
+    """
+    带合并的写缓冲（write-behind），
+    put 只写入内存中的缓冲区，同一表、同一 row_key、同一列在一个刷新周期内的多次写入会被合并为一个单元格，
+    默认后写入的覆盖先写入的，也可以指定合并函数（如累加计数）；
+    缓冲区按时间间隔或行数刷新，每张表通过一次 putMultiple 写入。
+
+    写入失败的数据会放回缓冲区等待下次刷新，flush/close 会抛出 IOError，
+    放回的数据超过 max_pending_rows 行时会被丢弃（计入 stats["dropped_rows"]），close 时同样抛出 IOError。
+
+    注意缓冲区中的数据在刷新之前对读取不可见，进程崩溃时会丢失，
+    合并之后单元格只保留最后一个版本，需要保留每次写入的历史版本时不适合使用。
+    """
+
+    def __init__(
+        self,
+        client: HBaseClient,
+        flush_interval: Union[int, float] = 1,
+        max_rows: int = 1000,
+        merge: Callable[[Any, Any], Any] = last_write_wins,
+        typed: bool = False,
+        durability: Union[int, str] = None,
+        max_pending_rows: int = 100000,
+    ):
+        """
+        :param client:
+        :param flush_interval: 后台定时刷新的间隔，秒，0 表示只在行数达到上限或手动 flush 时刷新
+        :param max_rows: 缓冲区中的行数（所有表合计）达到多少时在 put 中同步刷新
+        :param merge: 单元格的合并函数 (旧值, 新值) -> 合并后的值
+        :param typed: 同 HBaseClient.put_row
+        :param durability: 同 HBaseClient.put_row
+        :param max_pending_rows: 写入失败后缓冲区最多保留的行数，超过时丢弃写入失败的数据
+        """
+        self.client = client
+        self.max_rows = max_rows
+        self.merge = merge
+        self.typed = typed
+        self.durability = durability
+        self.max_pending_rows = max_pending_rows
+        # 写入和合并的次数统计
+        self.stats = {
+            "puts": 0,
+            "cells": 0,
+            "flushes": 0,
+            "flushed_rows": 0,
+            "flushed_cells": 0,
+            "failed_flushes": 0,
+            "dropped_rows": 0,
+        }
+
+        # {table: {row_key: {cf: {q: v}}}}
+        self._buffer = {}
+        self._rows = 0
+        self._lock = threading.Lock()
+        # 保证刷新按顺序进行，否则较早的数据可能在较新的数据之后写入
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval:
+            self._flusher = threading.Thread(
+                target=self._flush_loop,
+                args=(flush_interval,),
+                name="hbase-buffered-writer",
+                daemon=True,
+            )
+            self._flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _flush_loop(self, interval: Union[int, float]):
+        while not self._closed.wait(interval):
+            try:
+                self.flush()
+            except IOError:
+                # 失败的数据已放回缓冲区或计入 dropped_rows，由下次刷新或 close 处理
+                pass
+
+    def _merge_into(self, rows: Dict[str, Dict], row_key: str, row_value: Dict) -> int:
+        """
+        将 row_value 合并到 rows[row_key] 中，返回新增的行数（0 或 1）
+        """
+        merge = self.merge
+        new_row = 0
+        current = rows.get(row_key)
+        if current is None:
+            current = rows[row_key] = {}
+            new_row = 1
+        for column_family, column_data in row_value.items():
+            if column_family == "row_key":
+                continue
+            cells = current.get(column_family)
+            if cells is None:
+                current[column_family] = dict(column_data)
+                continue
+            for k, v in column_data.items():
+                cells[k] = merge(cells[k], v) if k in cells else v
+        return new_row
+
+    def put(self, table: str, row_key: str, row_value: Dict):
+        """
+        写入缓冲区，参数同 HBaseClient.put_row，
+        不会修改传入的 row_value
+
+        :param table:
+        :param row_key:
+        :param row_value:
+        :return:
+        """
+        with self._lock:
+            rows = self._buffer.get(table)
+            if rows is None:
+                rows = self._buffer[table] = {}
+            self._rows += self._merge_into(rows, row_key, row_value)
+            self.stats["puts"] += 1
+            self.stats["cells"] += sum(
+                len(v) for k, v in row_value.items() if k != "row_key"
+            )
+            full = self._rows >= self.max_rows
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        将缓冲区中合并后的数据写入 HBase，返回写入的行数，
+        某张表写入失败（HBaseClient 重试之后）时，其数据会放回缓冲区等待下次刷新，
+        期间新写入的值在合并时被视为更新的值，然后抛出 IOError；
+        放回后缓冲区超过 max_pending_rows 行时，写入失败的数据直接丢弃
+
+        :return:
+        """
+        with self._flush_lock:
+            with self._lock:
+                buffer, self._buffer, self._rows = self._buffer, {}, 0
+
+            written = written_cells = 0
+            failed = {}
+            for table, rows in buffer.items():
+                if (
+                    self.client.put_rows(table, rows, self.typed, self.durability)
+                    is None
+                ):
+                    failed[table] = rows
+                    continue
+                written += len(rows)
+                written_cells += sum(
+                    len(cells)
+                    for row_value in rows.values()
+                    for cells in row_value.values()
+                )
+
+            failed_rows = sum(len(rows) for rows in failed.values())
+            with self._lock:
+                self.stats["flushes"] += 1
+                self.stats["flushed_rows"] += written
+                self.stats["flushed_cells"] += written_cells
+                dropped = failed and self._rows + failed_rows > self.max_pending_rows
+                if dropped:
+                    self.stats["dropped_rows"] += failed_rows
+                else:
+                    for table, rows in failed.items():
+                        newer = self._buffer.get(table, {})
+                        for row_key, row_value in newer.items():
+                            self._merge_into(rows, row_key, row_value)
+                        self._buffer[table] = rows
+                    self._rows = sum(len(rows) for rows in self._buffer.values())
+                if failed:
+                    self.stats["failed_flushes"] += 1
+            if failed:
+                raise IOError(
+                    "failed to write {} rows into {}, {}".format(
+                        failed_rows,
+                        ", ".join(failed),
+                        (
+                            "dropped"
+                            if dropped
+                            else "kept in the buffer for the next flush"
+                        ),
+                    )
+                )
+            return written
+
+    def close(self):
+        """
+        停止后台刷新并写入剩余的数据，
+        仍有数据没有写入或者之前有数据被丢弃时抛出 IOError
+
+        :return:
+        """
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        if self.stats["dropped_rows"]:
+            raise IOError(
+                "{} rows were dropped after failed writes".format(
+                    self.stats["dropped_rows"]
+                )
+            )
+
+
+if __name__ == "__main__":
+    with HBaseClient("localhost", 9090) as hc:
+        # last write wins
+        with BufferedWriter(hc, flush_interval=1) as writer:
+            for i in range(10000):
+                writer.put("YOUR_TABLE_NAME", "hot_key", {"cf01": {"status": str(i)}})
+            print(writer.stats)
+
+        # keep the largest value seen within the flush window
+        with BufferedWriter(hc, merge=max, typed=True) as writer:
+            for i in range(10000):
+                writer.put(
+                    "YOUR_TABLE_NAME",
+                    "page_{}".format(i % 10),
+                    {"cf01": {"last_seen": i}},
+                )
+            print(writer.stats)
@@ -6,7 +6,9 @@
 @File   : customer_tools.py
 @Time   : 2018/8/20 0020 10:42
 """
+import threading
 import time
+from collections import deque
 
 from confluent_kafka.cimpl import (
     Consumer,
@@ -17,6 +19,177 @@ from confluent_kafka.cimpl import (
 )
 
 
+class OffsetTracker(object):
+    """
+    手动批量提交offset的工具, 实现至少一次(at-least-once)消费, 又不需要每条消息提交一次,
+    消息拉取后通过track按顺序登记, 处理完成后通过done标记, 可以乱序完成(如多线程处理),
+    每个partition只提交连续处理完成的最大位置, 没有处理完的消息在重启或rebalance之后会被重新消费;
+    每处理完commit_every条消息或者距离上次提交超过commit_interval_ms时异步提交一次,
+    partition被回收(rebalance)和flush时同步提交.
+    只有确认提交成功(同步提交返回或者on_commit回调)后才记为已提交, 异步提交失败的位置会在下次提交时重新提交,
+    异步提交时需要将on_commit配置为Consumer的on_commit回调, KConsumer的manual_commit会自动配置.
+    """
+
+    def __init__(
+            self,
+            consumer: Consumer,
+            commit_every: int = 1000,
+            commit_interval_ms: int = 5000,
+    ):
+        """
+        :param consumer:
+        :param commit_every: 处理完多少条消息后提交一次
+        :param commit_interval_ms: 距离上次提交超过多少毫秒后提交一次
+        """
+        self.consumer = consumer
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval_ms / 1000
+        # {(topic, partition): (按拉取顺序排列的未完成offset, 已完成但前面还有未完成消息的offset)}
+        self._pending = {}
+        # {(topic, partition): 可以提交的offset, 即下一条待消费消息的offset}
+        self._positions = {}
+        self._committed = {}
+        self._uncommitted = 0
+        self._last_commit = time.monotonic()
+        self._lock = threading.Lock()
+
+    def track(self, messages: list):
+        """
+        按拉取顺序登记消息, 需要在done之前调用
+        :param messages: Message列表
+        :return:
+        """
+        with self._lock:
+            for msg in messages:
+                key = (msg.topic(), msg.partition())
+                state = self._pending.get(key)
+                if state is None:
+                    state = self._pending[key] = (deque(), set())
+                state[0].append(msg.offset())
+
+    def done(self, messages: list):
+        """
+        标记消息已经处理完成, 达到提交条件时异步提交
+        :param messages: Message列表
+        :return:
+        """
+        with self._lock:
+            for msg in messages:
+                state = self._pending.get((msg.topic(), msg.partition()))
+                # partition已经被回收
+                if state is None:
+                    continue
+                pending, finished = state
+                offset = msg.offset()
+                if not pending or pending[0] != offset:
+                    finished.add(offset)
+                    continue
+                # 队首完成后, 连同后面已经完成的消息一起出队
+                pending.popleft()
+                while pending and pending[0] in finished:
+                    finished.discard(pending[0])
+                    offset = pending.popleft()
+                self._positions[(msg.topic(), msg.partition())] = offset + 1
+            self._uncommitted += len(messages)
+            due = self._uncommitted >= self.commit_every
+        if due:
+            self.commit()
+        else:
+            self.maybe_commit()
+
+    def maybe_commit(self):
+        """
+        距离上次提交超过commit_interval_ms并且有未提交的消息时异步提交
+        :return:
+        """
+        if (
+            self._uncommitted
+            and time.monotonic() - self._last_commit >= self.commit_interval
+        ):
+            self.commit()
+
+    def _offsets(self, keys=None, force: bool = False) -> list:
+        """
+        需要提交的位置, force为False时跳过已经确认提交过的partition, 需要持有锁
+        """
+        return [
+            TopicPartition(key[0], key[1], position)
+            for key, position in self._positions.items()
+            if (keys is None or key in keys)
+            and (force or self._committed.get(key) != position)
+        ]
+
+    def _commit(self, offsets: list, asynchronous: bool) -> list:
+        if not offsets:
+            return offsets
+        if asynchronous:
+            # 结果由on_commit回调记录
+            self.consumer.commit(offsets=offsets, asynchronous=True)
+        else:
+            self.on_commit(
+                None, self.consumer.commit(offsets=offsets, asynchronous=False)
+            )
+        return offsets
+
+    def on_commit(self, error, partitions: list):
+        """
+        提交结果的回调, 只把提交成功的位置记为已提交
+        :param error: 整个提交请求的KafkaError, 成功时为None
+        :param partitions: 带有各自提交结果的TopicPartition列表
+        :return:
+        """
+        if error is not None or not partitions:
+            return
+        with self._lock:
+            for p in partitions:
+                key = (p.topic, p.partition)
+                # 已经被回收的partition不再记录
+                if p.error is None and key in self._pending:
+                    self._committed[key] = p.offset
+
+    def commit(self, asynchronous: bool = True) -> list:
+        """
+        提交所有partition连续处理完成的位置, 跳过已经确认提交过的partition
+        :param asynchronous: 是否异步提交
+        :return: 提交的TopicPartition列表
+        """
+        with self._lock:
+            offsets = self._offsets()
+            self._uncommitted = 0
+            self._last_commit = time.monotonic()
+        return self._commit(offsets, asynchronous)
+
+    def flush(self) -> list:
+        """
+        同步提交所有partition当前的位置, 关闭consumer之前调用
+        :return:
+        """
+        with self._lock:
+            offsets = self._offsets(force=True)
+            self._uncommitted = 0
+            self._last_commit = time.monotonic()
+        return self._commit(offsets, asynchronous=False)
+
+    def revoke(self, partitions: list) -> list:
+        """
+        partition被回收时同步提交这些partition当前的位置, 并丢弃其状态,
+        之后对这些partition的消息调用done会被忽略
+        :param partitions: TopicPartition列表
+        :return: 提交的TopicPartition列表
+        """
+        keys = {(p.topic, p.partition) for p in partitions}
+        with self._lock:
+            offsets = self._offsets(keys, force=True)
+        try:
+            return self._commit(offsets, asynchronous=False)
+        finally:
+            with self._lock:
+                for key in keys:
+                    self._pending.pop(key, None)
+                    self._positions.pop(key, None)
+                    self._committed.pop(key, None)
+
+
 class KConsumer(object):
     """
     在confluent-kafka-python的consumer之上抽象出来的工具
@@ -29,6 +202,10 @@ class KConsumer(object):
             offset_start: str = None,
             client_id: str = None,
             is_break: bool = False,
+            poll_timeout: float = 1.0,
+            manual_commit: bool = False,
+            commit_every: int = 1000,
+            commit_interval_ms: int = 5000,
             **kwargs
     ):
         """
@@ -42,7 +219,14 @@ class KConsumer(object):
                     'error' - 追踪消费者收到的错误信息,'message->err'.
                     等等...
         :param str client_id: 本consumer的标识,建议尽量定义一个,方便kafka集群追踪问题.
-        :param bool is_break: 如果遍历完topic是否退出，默认为False
+        :param bool is_break: 如果分配到的所有partition都已消费到末尾是否退出，默认为False
+        :param float poll_timeout: 每次poll最长等待的时间, 秒, 有消息时会立即返回,
+                只影响没有消息时多久检查一次running
+        :param bool manual_commit: 是否关闭自动提交, 改用OffsetTracker在消息处理完成后批量提交,
+                get_msg/get_batches在调用方请求下一条消息(批)时认为上一条消息(批)已经处理完成,
+                其他方式消费时需要自行调用self.offsets的track和done
+        :param int commit_every: 同OffsetTracker
+        :param int commit_interval_ms: 同OffsetTracker
         :param kwargs: 其他参数详见说明文档.
         """
 
@@ -57,22 +241,47 @@ class KConsumer(object):
             "heartbeat.interval.ms": 3000,
             # 自动提交偏移量的间隔, 0为禁止自动提交.
             "auto.commit.interval.ms": 5000,
+            "enable.auto.commit": not manual_commit,
+            # 消费到partition末尾时产生_PARTITION_EOF事件, is_break依赖该事件判断是否消费完毕
+            "enable.partition.eof": is_break,
             # topic相关设置, 这些设置应该是基于topic(而非每个consumer)进行设置, 但是在此可以覆盖全局配置
             "default.topic.config": {
                 "auto.offset.reset": offset_start if offset_start else "latest",
             },
         }
         conf = {**conf, **kwargs}
+        # 是否开启了自动提交, 自行提交offset的工具(如HBaseSink)需要检查
+        self.auto_commit = str(conf.get("enable.auto.commit", True)).lower() not in (
+            "false",
+            "0",
+        )
+        self.offsets = None
+        self._on_commit_callback = conf.get("on_commit")
+        if manual_commit:
+            # 异步提交的结果通过on_commit回调交给OffsetTracker
+            conf["on_commit"] = self._on_commit
 
         self.consumer = Consumer(conf)
         self.running = True
         self.is_break = is_break
+        self.poll_timeout = poll_timeout
+        # 当前分配到的partition, 以及其中已经消费到末尾的partition, 元素为(topic, partition)
+        self.assigned = set()
+        self.eof = set()
+        if manual_commit:
+            self.offsets = OffsetTracker(
+                self.consumer, commit_every, commit_interval_ms
+            )
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.consumer.close()
+        try:
+            if self.offsets:
+                self.offsets.flush()
+        finally:
+            self.consumer.close()
 
     @staticmethod
     def msg_to_dict(msg) -> dict:
@@ -96,28 +305,139 @@ class KConsumer(object):
                 "error": msg.error(),
             }
 
-    def get_msg(self, topics: list) -> iter:
+    def _on_commit(self, error, partitions: list):
+        if self.offsets:
+            self.offsets.on_commit(error, partitions)
+        if self._on_commit_callback:
+            self._on_commit_callback(error, partitions)
+
+    def _on_assign(self, consumer, partitions: list):
+        self.assigned = {(p.topic, p.partition) for p in partitions}
+        self.eof &= self.assigned
+
+    def _on_revoke(self, consumer, partitions: list):
+        if self.offsets:
+            self.offsets.revoke(partitions)
+        revoked = {(p.topic, p.partition) for p in partitions}
+        self.assigned -= revoked
+        self.eof -= revoked
+
+    def subscribe(self, topics: list):
+        """
+        订阅topic, 并跟踪rebalance后分配到的partition
+        :param topics:
+        :return:
+        """
+        self.consumer.subscribe(
+            topics, on_assign=self._on_assign, on_revoke=self._on_revoke
+        )
+
+    def reached_end(self) -> bool:
+        """
+        分配到的所有partition是否都已消费到末尾
+        :return:
+        """
+        return bool(self.assigned) and self.eof >= self.assigned
+
+    def _track(self, msg) -> bool:
+        """
+        根据消息更新partition的EOF状态
+        :param msg:
+        :return: 是否为_PARTITION_EOF事件
+        """
+        partition = (msg.topic(), msg.partition())
+        error = msg.error()
+        if error is None:
+            self.eof.discard(partition)
+            return False
+        if error.code() == KafkaError._PARTITION_EOF:
+            self.eof.add(partition)
+            return True
+        return False
+
+    def get_msg(self, topics: list, timeout: float = None) -> iter:
         """
         从订阅的主题轮询获取消息的生成器
-        _PARTITION_EOF表示broker内已经没有新的消息了
+        _PARTITION_EOF表示broker内该partition已经没有新的消息了, 只记录该partition的状态,
+        不会影响其他partition的消费
         :param topics: 需要订阅的topic列表
+        :param timeout: 每次poll最长等待的时间, 默认使用poll_timeout
         :return: 返回Message类型的消息的迭代器
         """
-        self.consumer.subscribe(topics)
+        self.subscribe(topics)
+        timeout = self.poll_timeout if timeout is None else timeout
 
+        offsets = self.offsets
         while self.running:
-            msg = self.consumer.poll(timeout=1.0)
+            msg = self.consumer.poll(timeout=timeout)
             if not msg:
+                if offsets:
+                    offsets.maybe_commit()
+                continue
+            elif self._track(msg):
+                if self.is_break and self.reached_end():
+                    self.running = False
+                    break
                 continue
             elif msg.error():
-                if msg.error().code() == KafkaError._PARTITION_EOF:
-                    if self.is_break:
-                        self.running = False
-                        break
-                    time.sleep(1)
-                    continue
                 raise KafkaException(msg.error())
-            yield msg
+            if offsets:
+                offsets.track([msg])
+                yield msg
+                offsets.done([msg])
+            else:
+                yield msg
+
+    def consume_batch(self, max_messages: int = 1000, timeout: float = None) -> tuple:
+        """
+        通过一次consume调用获取一批消息, 将正常消息与错误分开,
+        _PARTITION_EOF不算作错误, 只记录对应partition的状态, 见reached_end
+        :param max_messages: 最多获取的消息数
+        :param timeout: 最长等待时间, 秒, 默认使用poll_timeout
+        :return: (消息列表, KafkaError列表)
+        """
+        timeout = self.poll_timeout if timeout is None else timeout
+        messages, errors = [], []
+        eof = self.eof
+        for msg in self.consumer.consume(max_messages, timeout):
+            error = msg.error()
+            if error is None:
+                messages.append(msg)
+                # 收到新消息的partition不再处于末尾, 没有partition处于末尾时跳过
+                if eof:
+                    eof.discard((msg.topic(), msg.partition()))
+            elif not self._track(msg):
+                errors.append(error)
+        return messages, errors
+
+    def get_batches(
+            self, topics: list, max_messages: int = 1000, timeout: float = None
+    ) -> iter:
+        """
+        从订阅的主题批量获取消息的生成器, 比get_msg逐条获取的开销小得多,
+        每次返回(消息列表, KafkaError列表), 两者都为空的批次不会返回
+        :param topics: 需要订阅的topic列表
+        :param max_messages: 每批最多的消息数
+        :param timeout: 每批最长等待时间, 秒, 默认使用poll_timeout
+        :return: (Message列表, KafkaError列表)的迭代器
+        """
+        self.subscribe(topics)
+
+        offsets = self.offsets
+        while self.running:
+            messages, errors = self.consume_batch(max_messages, timeout)
+            if offsets:
+                offsets.track(messages)
+            if messages or errors:
+                yield messages, errors
+            if offsets:
+                if messages:
+                    offsets.done(messages)
+                else:
+                    offsets.maybe_commit()
+            if self.is_break and self.reached_end():
+                self.running = False
+                break
 
     def get_topics_info(self, topic: str = None) -> list:
         """
@@ -202,3 +522,27 @@ if __name__ == "__main__":
         msgs = c.get_msg(["test_topic"])
         for receive_msg in msgs:
             cap_msg(c.msg_to_dict(receive_msg))
+
+    with KConsumer(
+            kafka_server="test_kafka",
+            group_id="test_batch_group",
+            client_id="test_client",
+            offset_start="earliest",
+    ) as c:
+        for batch, batch_errors in c.get_batches(["test_topic"], max_messages=10000):
+            for receive_error in batch_errors:
+                print(receive_error)
+            print(len(batch))
+
+    # 处理完成后批量提交offset, 每1000条或者每5秒提交一次
+    with KConsumer(
+            kafka_server="test_kafka",
+            group_id="test_manual_commit_group",
+            client_id="test_client",
+            offset_start="earliest",
+            manual_commit=True,
+            commit_every=1000,
+            commit_interval_ms=5000,
+    ) as c:
+        for receive_msg in c.get_msg(["test_topic"]):
+            cap_msg(c.msg_to_dict(receive_msg))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+@Author : Sz
+@Project: rtg-tools
+@File   : sink_tools.py
+@Time   : 2020/10/30 0030 11:05
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from confluent_kafka.cimpl import KafkaException, Message, TopicPartition
+
+from hbase.hbase_client.ttypes import TPut
+from hbase.hbase_tools import HBaseClient
+from kafka.customer_tools import KConsumer
+
+logger = logging.getLogger(__name__)
+
+
+class HBaseSink(object):
+    """
+    Kafka -> HBase 的写入工具，
+    按批消费消息，由 mapper 将消息转换为 TPut，按分区并行通过 putMultiple 写入，
+    只有当某个分区的这批数据全部写入成功后才提交该分区的 offset，
+    写入失败的分区会回退到这批消息的起始位置重新消费，即至少一次（at-least-once）。
+
+    重复消费时同一条消息会被再次写入，mapper 使用消息的时间戳作为 TPut.timestamp 时，
+    重复写入的是同一个版本，结果与只写入一次相同。
+
+    KConsumer 需要关闭自动提交，即 manual_commit=True 或 **{"enable.auto.commit": False}，
+    否则后台的自动提交会提交还没有写入的消息，初始化时会检查并抛出 ValueError
+    """
+
+    def __init__(
+        self,
+        consumer: KConsumer,
+        client: HBaseClient,
+        table: str,
+        mapper: Callable[[Message], Union[TPut, List[TPut], None]],
+        batch_size: int = 1000,
+        batch_timeout: Union[int, float] = 1,
+        workers: int = 4,
+        put_batch_size: int = 1000,
+        durability: Union[int, str] = None,
+        retry_backoff: Union[int, float] = 1,
+    ):
+        """
+        :param consumer:
+        :param client:
+        :param table: 写入的表
+        :param mapper: 消息转换函数，返回 TPut、TPut 列表或 None（跳过该消息）
+        :param batch_size: 每批最多消费的消息数
+        :param batch_timeout: 每批最多等待的时间，秒
+        :param workers: 同时写入的分区数，同一分区的数据总是按顺序写入
+        :param put_batch_size: 每次 putMultiple 的最大行数
+        :param durability: 同 HBaseClient.put_row
+        :param retry_backoff: 写入失败后重新消费之前等待的时间，秒
+        """
+        if consumer.auto_commit:
+            raise ValueError(
+                "HBaseSink commits offsets itself, "
+                "the consumer must disable auto commit "
+                "(manual_commit=True or enable.auto.commit=False)"
+            )
+        self.consumer = consumer
+        self.client = client
+        self.table = table
+        self.mapper = mapper
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.workers = workers
+        self.put_batch_size = put_batch_size
+        self.durability = durability
+        self.retry_backoff = retry_backoff
+        self.running = True
+        self.stats = {
+            "messages": 0,
+            "rows": 0,
+            "batches": 0,
+            "commits": 0,
+            "failures": 0,
+            "errors": 0,
+            "started": None,
+        }
+
+    def throughput(self) -> Dict[str, float]:
+        """
+        启动以来的平均吞吐量
+
+        :return: {"messages_per_second": ..., "rows_per_second": ...}
+        """
+        started = self.stats["started"]
+        elapsed = time.time() - started if started else 0
+        if not elapsed:
+            return {"messages_per_second": 0.0, "rows_per_second": 0.0}
+        return {
+            "messages_per_second": self.stats["messages"] / elapsed,
+            "rows_per_second": self.stats["rows"] / elapsed,
+        }
+
+    def _write_partition(self, messages: List[Message]) -> int:
+        """
+        转换并写入同一分区的一批消息，重试后仍失败时抛出 IOError
+
+        :param messages:
+        :return: 写入的行数
+        """
+        t_puts = []
+        for msg in messages:
+            mapped = self.mapper(msg)
+            if mapped is None:
+                continue
+            if isinstance(mapped, TPut):
+                t_puts.append(mapped)
+            else:
+                t_puts.extend(mapped)
+        for i in range(0, len(t_puts), self.put_batch_size):
+            batch = t_puts[i : i + self.put_batch_size]
+            if (
+                self.client.put_rows(self.table, batch, durability=self.durability)
+                is None
+            ):
+                raise IOError(
+                    "failed to put {} rows into {}".format(len(batch), self.table)
+                )
+        return len(t_puts)
+
+    def _poll_batch(self) -> Dict[Tuple[str, int], List[Message]]:
+        """
+        消费一批消息并按分区分组，分区内保持原有顺序，
+        非致命的错误（如 broker 暂时不可用，librdkafka 会自行重试）只记录日志；
+        出现致命错误时先把本批各分区回退到起点，保证没有写入的消息不会被之后的提交跳过，再抛出异常
+        """
+        messages, errors = self.consumer.consume_batch(
+            self.batch_size, self.batch_timeout
+        )
+        grouped = {}
+        for msg in messages:
+            grouped.setdefault((msg.topic(), msg.partition()), []).append(msg)
+
+        fatal = None
+        for error in errors:
+            if error.fatal():
+                fatal = fatal or error
+                continue
+            self.stats["errors"] += 1
+            logger.warning("ignoring non-fatal consumer error: %s", error)
+        if fatal is not None:
+            for (topic, partition), partition_messages in grouped.items():
+                self.consumer.consumer.seek(
+                    TopicPartition(topic, partition, partition_messages[0].offset())
+                )
+            raise KafkaException(fatal)
+        return grouped
+
+    def process_batch(self, executor: ThreadPoolExecutor) -> Optional[int]:
+        """
+        处理一批消息：并行写入各分区，提交成功分区的 offset，失败分区回退到本批起点，
+        mapper 抛出的异常会在提交成功分区之后重新抛出
+
+        :param executor:
+        :return: 本批消息数，没有消费到消息时返回 None
+        """
+        grouped = self._poll_batch()
+        if not grouped:
+            return None
+
+        futures = {
+            partition: executor.submit(self._write_partition, messages)
+            for partition, messages in grouped.items()
+        }
+        offsets = []
+        failed = []
+        fatal = None
+        for (topic, partition), future in futures.items():
+            messages = grouped[(topic, partition)]
+            error = future.exception()
+            if error is None:
+                self.stats["rows"] += future.result()
+                # 提交的是下一条待消费消息的 offset
+                offsets.append(
+                    TopicPartition(topic, partition, messages[-1].offset() + 1)
+                )
+                continue
+            failed.append(TopicPartition(topic, partition, messages[0].offset()))
+            # 只有写入失败可以通过重新消费解决，mapper 的异常重试也一样会失败
+            if not isinstance(error, IOError):
+                fatal = fatal or error
+
+        if offsets:
+            self.consumer.consumer.commit(offsets=offsets, asynchronous=False)
+            self.stats["commits"] += 1
+        for topic_partition in failed:
+            self.consumer.consumer.seek(topic_partition)
+        self.stats["batches"] += 1
+        if fatal is not None:
+            raise fatal
+        if failed:
+            self.stats["failures"] += len(failed)
+            time.sleep(self.retry_backoff)
+
+        count = sum(len(messages) for messages in grouped.values())
+        self.stats["messages"] += count
+        return count
+
+    def run(self, topics: List[str], max_batches: int = None):
+        """
+        订阅 topics 并持续写入，直到 stop() 或处理完 max_batches 批
+
+        :param topics:
+        :param max_batches: 最多处理的批数（包括没有消息的空批），为空时不限制
+        :return:
+        """
+        self.consumer.subscribe(topics)
+        self.stats["started"] = self.stats["started"] or time.time()
+        batches = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while self.running and (max_batches is None or batches < max_batches):
+                self.process_batch(executor)
+                batches += 1
+
+    def stop(self):
+        self.running = False
+
+
+if __name__ == "__main__":
+    import json
+
+    def to_put(msg: Message) -> TPut:
+        record = json.loads(msg.value())
+        row_key = record.pop("row_key")
+        t_put = TPut(row_key.encode(), HBaseClient.encode_row_value(record))
+        # 重复消费时写入同一个版本
+        t_put.timestamp = msg.timestamp()[1]
+        return t_put
+
+    with KConsumer(
+        kafka_server="test_kafka",
+        group_id="test_hbase_sink",
+        client_id="test_client",
+        offset_start="earliest",
+        **{"enable.auto.commit": False},
+    ) as kc, HBaseClient("localhost", 9090) as hc:
+        sink = HBaseSink(kc, hc, "YOUR_TABLE_NAME", to_put, batch_size=5000, workers=8)
+        try:
+            sink.run(["test_topic"])
+        finally:
+            print(sink.stats, sink.throughput())